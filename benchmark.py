@@ -0,0 +1,295 @@
+"""
+Matcher micro-benchmark.
+
+Generates trigger sets shaped like the shipped triggers.json, replays a
+synthetic keystroke stream through TextExpander.on_key_press with a fake
+keyboard backend, and reports keystrokes/sec, per-key latency and memory
+per trigger. Results can be saved as a baseline and compared against later.
+
+    python benchmark.py --sizes 100 10000 1000000 --save before.json
+    python benchmark.py --compare before.json
+"""
+import argparse
+import gc
+import json
+import math
+import random
+import string
+import sys
+import time
+import tracemalloc
+import types
+
+
+class FakeKeyboard(types.ModuleType):
+    """ Stands in for the keyboard package: no hooks, no keys held. """
+
+    def __init__(self):
+        super().__init__('keyboard')
+
+    def on_press(self, callback):
+        pass
+
+    def add_hotkey(self, *args, **kwargs):
+        pass
+
+    def is_pressed(self, key):
+        return False
+
+
+# text_expander installs real hooks through the keyboard package, so the fake
+# has to be in place before it is imported.
+sys.modules['keyboard'] = FakeKeyboard()
+import text_expander
+from injector import Injector
+from keystrokes import Keystrokes, RecordingOutput
+from trigger_store import TriggerStore
+
+
+class BenchmarkKeymap:
+    """ Keys named after themselves and every letter typed as unicode, so no layout is looked up. """
+
+    def scan_code(self, name):
+        return name
+
+    def is_modifier(self, scan_code):
+        return False
+
+    def tap(self, name):
+        return [(name, True), (name, False)]
+
+    def letter_plan(self, letter):
+        return [letter]
+
+
+class BenchmarkInjector(Injector):
+    """ Injector recording the keys it would send. """
+
+    def __init__(self, **kwargs):
+        super().__init__(keys=Keystrokes(RecordingOutput(), BenchmarkKeymap()), listen=False, **kwargs)
+        # Nothing is listening, so don't space the chunks out.
+        self.unpaced_rate = float('inf')
+
+
+text_expander.Injector = BenchmarkInjector
+# No keyboard to read the caps lock LED from.
+text_expander.caps_lock_on = lambda: False
+
+
+class FakeEvent:
+    """ The KeyboardEvent fields TextExpander reads. """
+
+    __slots__ = ('name', 'time', 'event_type', 'modifiers', 'scan_code')
+
+    def __init__(self, name, time):
+        self.name = name
+        self.time = time
+        self.event_type = 'down'
+        # Like on Windows, where names already carry the shift state.
+        self.modifiers = None
+        self.scan_code = 0
+
+
+class BenchmarkExpander(text_expander.TextExpander):
+    """ TextExpander with generated triggers and default settings, touching no files. """
+
+    def __init__(self, triggers):
+        self.generated_triggers = triggers
+        super().__init__()
+
+    def load_triggers(self):
+        self.triggers = TriggerStore(self.generated_triggers)
+        self.rebuild_matcher()
+
+    def load_settings(self):
+        self.settings['reset_on_click'] = False
+        self.settings['adaptive_pacing'] = False
+        self.settings['paste_long_responses'] = False
+
+    def save_triggers(self):
+        pass
+
+    def save_settings(self):
+        pass
+
+
+def load_shape(path):
+    """ Trigger lengths, casing, flags and responses to generate lookalikes from. """
+    with open(path, 'r') as f:
+        triggers = json.load(f)
+    count = max(len(triggers), 1)
+    return {
+        'lengths': [len(trigger) for trigger in triggers] or [4],
+        'upper': sum(trigger.isupper() for trigger in triggers) / count,
+        'case_sensitive': sum(bool(data.get('case_sensitive')) for data in triggers.values()) / count,
+        'require_space': sum(bool(data.get('require_space')) for data in triggers.values()) / count,
+        'responses': [data['response'] for data in triggers.values()] or ['response'],
+    }
+
+
+def make_triggers(count, shape, rng):
+    """
+    Returns `count` unique triggers. Lengths follow the shape, growing with
+    the set so large sets don't run out of short triggers. Responses are
+    shared with the shape.
+    """
+    triggers = {}
+    while len(triggers) < count:
+        length = rng.choice(shape['lengths']) + int(math.log(len(triggers) + 1, 26))
+        letters = string.ascii_uppercase if rng.random() < shape['upper'] else string.ascii_lowercase
+        trigger = ''.join(rng.choice(letters) for _ in range(length))
+        triggers[trigger] = {
+            'enabled': True,
+            'response': rng.choice(shape['responses']),
+            'tags': [],
+            'case_sensitive': rng.random() < shape['case_sensitive'],
+            'require_space': rng.random() < shape['require_space'],
+        }
+    return triggers
+
+
+def make_keystrokes(triggers, count, rng, trigger_rate=0.05, backspace_rate=0.02):
+    """
+    Returns `count` key names: random words separated by spaces, with
+    triggers typed in place of a word at `trigger_rate` and the occasional
+    backspace.
+    """
+    names = []
+    trigger_list = list(triggers)
+    while len(names) < count:
+        if trigger_list and rng.random() < trigger_rate:
+            word = rng.choice(trigger_list)
+        else:
+            word = ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 9)))
+        for char in word:
+            names.append(char)
+            if rng.random() < backspace_rate:
+                names += ['backspace', char]
+        names.append('space')
+    return names[:count]
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def traced_bytes():
+    # Collecting also empties the free lists, whose blocks tracemalloc
+    # still counts as in use.
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def run(size, keystrokes, shape, seed):
+    rng = random.Random(seed)
+    triggers = make_triggers(size, shape, rng)
+
+    # The record store TextExpander keeps, leaving out the response text
+    # itself (shared between the generated dicts, copied into the store),
+    # and the matcher compiled from it, which points into the store.
+    tracemalloc.start()
+    store = TriggerStore(triggers)
+    record_bytes = traced_bytes() - len(store.columns.responses)
+    matcher = text_expander.TriggerIndex(store)
+    total_bytes = traced_bytes() - len(store.columns.responses)
+    tracemalloc.stop()
+    del store, matcher
+
+    start = time.perf_counter()
+    expander = BenchmarkExpander(triggers)
+    build_time = time.perf_counter() - start
+
+    # Build the matcher again under tracemalloc; tracing slows it down too
+    # much to time it in the same pass.
+    tracemalloc.start()
+    matcher = text_expander.TriggerIndex(expander.triggers, expander.settings['require_space'])
+    matcher_bytes = traced_bytes()
+    tracemalloc.stop()
+    del matcher
+
+    # 50ms between keys, well inside the idle timeout.
+    events = [FakeEvent(name, i * 0.05) for i, name in enumerate(make_keystrokes(triggers, keystrokes, rng))]
+    latencies = []
+    on_key_press = expander.on_key_press
+    clock = time.perf_counter_ns
+    total_start = clock()
+    for event in events:
+        key_start = clock()
+        on_key_press(event)
+        latencies.append(clock() - key_start)
+    total = clock() - total_start
+    expander.injector.wait()
+
+    latencies.sort()
+    return {
+        'size': size,
+        'keystrokes': len(events),
+        'keys_per_sec': len(events) / (total / 1e9),
+        'p50_us': percentile(latencies, 0.50) / 1000,
+        'p99_us': percentile(latencies, 0.99) / 1000,
+        'build_s': build_time,
+        'matcher_bytes_per_trigger': matcher_bytes / size,
+        'record_bytes_per_trigger': record_bytes / size,
+        'total_bytes_per_trigger': total_bytes / size,
+        'backspaces_sent': expander.injector.keys.output.events.count(('backspace', True)),
+    }
+
+
+COLUMNS = [
+    ('size', 'triggers', '{:>10}'),
+    ('keys_per_sec', 'keys/s', '{:>12,.0f}'),
+    ('p50_us', 'p50 us', '{:>9.1f}'),
+    ('p99_us', 'p99 us', '{:>9.1f}'),
+    ('build_s', 'build s', '{:>9.2f}'),
+    ('matcher_bytes_per_trigger', 'matcher B/trig', '{:>15.0f}'),
+    ('record_bytes_per_trigger', 'records B/trig', '{:>15.0f}'),
+    ('total_bytes_per_trigger', 'total B/trig', '{:>13.0f}'),
+]
+
+
+def print_results(results, baseline=None):
+    print(''.join('{:>{}}'.format(title, len(fmt.format(0)) if key != 'size' else 10)
+                  for key, title, fmt in COLUMNS))
+    baseline = {result['size']: result for result in baseline or []}
+    for result in results:
+        print(''.join(fmt.format(result[key]) for key, title, fmt in COLUMNS))
+        before = baseline.get(result['size'])
+        if before:
+            # Change against the baseline, in percent; lower is better except for keys/s.
+            print(''.join('{:>10}'.format('') if key == 'size' else
+                          '{:>{}}'.format('{:+.0f}%'.format((result[key] / before[key] - 1) * 100) if before[key] else '-',
+                                          len(fmt.format(0)))
+                          for key, title, fmt in COLUMNS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark trigger matching on synthetic typing.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000],
+                        help="trigger set sizes to run (up to 1000000)")
+    parser.add_argument('--keystrokes', type=int, default=50000, help="keystrokes replayed per size")
+    parser.add_argument('--shape', default='triggers.json', help="trigger file to shape the sets after")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help="save the results as a baseline to this file")
+    parser.add_argument('--compare', help="compare against a baseline saved with --save")
+    args = parser.parse_args()
+
+    shape = load_shape(args.shape)
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)['results']
+
+    results = []
+    for size in args.sizes:
+        results.append(run(size, args.keystrokes, shape, args.seed))
+        print(f"done: {size} triggers", file=sys.stderr)
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'results': results}, f, indent=2)
+        print(f"Saved baseline to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import os
+
+# Clipboard formats holding a GDI handle instead of memory, which can't be
+# copied out. Windows synthesizes them back from the memory formats, e.g.
+# CF_BITMAP from CF_DIB.
+HANDLE_FORMATS = {2, 3, 9, 14, 0x80, 0x82, 0x83, 0x8E}
+
+
+class MemoryClipboard:
+    """ Clipboard kept in memory, standing in for the system one in tests. """
+
+    def __init__(self, contents=None):
+        self.contents = contents
+        # Every text set, in order.
+        self.history = []
+
+    def backup(self):
+        return self.contents
+
+    def restore(self, backup):
+        self.contents = backup
+
+    def set_text(self, text):
+        self.history.append(text)
+        self.contents = text
+
+
+class Win32Clipboard:
+    """
+    The Windows clipboard. A backup keeps every format that can be copied
+    out as data (text, images as CF_DIB, rich text, ...); formats that fail
+    to copy are left out of it.
+    """
+
+    def backup(self):
+        import win32clipboard
+        win32clipboard.OpenClipboard()
+        try:
+            formats = []
+            format = win32clipboard.EnumClipboardFormats(0)
+            while format:
+                formats.append(format)
+                format = win32clipboard.EnumClipboardFormats(format)
+            backup = []
+            for format in formats:
+                if format in HANDLE_FORMATS:
+                    continue
+                try:
+                    backup.append((format, win32clipboard.GetClipboardData(format)))
+                except Exception:
+                    pass
+            return backup
+        finally:
+            win32clipboard.CloseClipboard()
+
+    def restore(self, backup):
+        import win32clipboard
+        win32clipboard.OpenClipboard()
+        try:
+            win32clipboard.EmptyClipboard()
+            for format, data in backup:
+                if isinstance(data, (str, bytes)):
+                    try:
+                        win32clipboard.SetClipboardData(format, data)
+                    except Exception:
+                        pass
+        finally:
+            win32clipboard.CloseClipboard()
+
+    def set_text(self, text):
+        import win32clipboard
+        win32clipboard.OpenClipboard()
+        try:
+            win32clipboard.EmptyClipboard()
+            win32clipboard.SetClipboardData(win32clipboard.CF_UNICODETEXT, text)
+        finally:
+            win32clipboard.CloseClipboard()
+
+
+def system_clipboard():
+    """ The clipboard of this system, None where there is no backend for it. """
+    if os.name == 'nt':
+        return Win32Clipboard()
+    return None
@@ -0,0 +1,356 @@
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+
+import keyboard
+
+from keystrokes import Keystrokes
+
+# Job rate meaning "whatever the pacing table says for the focused application".
+AUTO = 'auto'
+
+
+def moving_average(average, value, weight=0.2):
+    return value if average is None else average + (value - average) * weight
+
+
+def foreground_app():
+    """ Executable name of the focused window's process, None where unknown. """
+    if os.name != 'nt':
+        return None
+    import win32api
+    import win32gui
+    import win32process
+    _, pid = win32process.GetWindowThreadProcessId(win32gui.GetForegroundWindow())
+    try:
+        # PROCESS_QUERY_LIMITED_INFORMATION
+        handle = win32api.OpenProcess(0x1000, False, pid)
+        return os.path.basename(win32process.GetModuleFileNameEx(handle, 0)).lower()
+    except Exception:
+        return None
+
+
+def keyboard_layout():
+    """ The keyboard layout of the focused window, None where unknown. """
+    if os.name != 'nt':
+        return None
+    import win32api
+    import win32gui
+    import win32process
+    thread_id, _ = win32process.GetWindowThreadProcessId(win32gui.GetForegroundWindow())
+    return win32api.GetKeyboardLayout(thread_id)
+
+
+class Injector:
+    """
+    Types expansions on a worker thread of its own.
+
+    Matching runs on the keyboard package's event thread, and typing a long
+    response there would hold back every key event until it was done. The
+    expander only queues a job here, so handling a key costs the same no
+    matter how long the response is. Jobs are typed one at a time, in the
+    order they were queued.
+
+    With `capture_typeahead`, keys the user types while an expansion is
+    being typed are suppressed and held (up to `typeahead_limit`, past which
+    they go through as usual), then replayed in order once it is done, so
+    they can't land in the middle of the response. Replayed keys are sent
+    to the OS again and come back through the keyboard hooks as real keys,
+    so the expander, hotkeys and `keyboard.is_pressed` all see them like
+    any other. `typeahead_latency` tells how long they were held back.
+
+    Keys are sent with `keys` (see keystrokes.Keystrokes). With `listen`,
+    the keyboard is hooked to follow which keys are held, so each job
+    releases them first, and to mark the events the injector sent as they
+    come back, for `is_own`. Texts are resolved to key events with
+    `Keystrokes.compile` once and the plans kept, least recently used
+    first, for the next expansion typing the same text on the same keyboard
+    layout.
+
+    Long texts are sent `chunk_size` characters at a time, no faster than
+    `unpaced_rate` characters per second even when not paced, and each
+    chunk only once the previous one came back through the keyboard hook
+    (where the OS tells, see `Keystrokes.wait_delivered`). The OS then
+    never holds more than a chunk or so, and the job stops between chunks
+    if `cancel` was called (the expander does so on escape) while the
+    application is still visibly typing. After each chunk every callback
+    added with `add_progress_listener` is called as callback(typed, total)
+    with the characters typed so far. `chunk_times` keeps (characters,
+    seconds) for each chunk, from sending it until it was delivered.
+
+    With a `pacing` table (see pacing.PacingTable), text is typed into each
+    application at the rate it allows, `paced_chunk_size` characters per
+    batch with pauses in between. Applications speed up after every
+    expansion and back off when `report_dropped` says they lost characters.
+
+    With a `clipboard` (see clipboard.py), texts that would take longer to
+    type than to paste are pasted instead: the clipboard is backed up and
+    set to the text, then the deletions and `paste_hotkey` are sent as one
+    batch and the backup put back. If the clipboard can't be set the text
+    is typed after all. Both costs are measured as expansions go
+    (`char_cost`, seconds per typed character until delivered, and
+    `paste_cost`, seconds per paste), so the length at which pasting wins
+    follows the machine and the pacing.
+    """
+
+    plan_cache_size = 256
+    chunk_size = 100
+    unpaced_rate = 2000
+    paced_chunk_size = 8
+    cancel_key = 'esc'
+    # Seconds after an expansion during which dropped characters are blamed on it.
+    report_window = 5
+    paste_hotkey = 'ctrl+v'
+    # Seconds the application gets to read the clipboard before it is restored.
+    paste_settle = 0.1
+    # Typed texts shorter than this are too noisy to measure.
+    min_measured_length = 20
+
+    def __init__(self, capture_typeahead=False, typeahead_limit=256, pacing=None, clipboard=None, keys=None, listen=True):
+        self.jobs = queue.Queue()
+        self.keys = Keystrokes() if keys is None else keys
+        # Echoes of the keys sent are only seen with the hook.
+        self.listening = listen
+        self.pacing = pacing
+        self.clipboard = clipboard
+        self.char_cost = None
+        self.paste_cost = self.paste_settle
+        # (application, time) of the last paced expansion finished.
+        self.last_paced = None
+        self.lock = threading.Lock()
+        self.busy = False
+        self.cancelled = threading.Event()
+        self.progress_listeners = []
+        # (characters, seconds) of each chunk sent, most recent last.
+        self.chunk_times = deque(maxlen=1000)
+        # (text, layout) -> (plan, index in the plan each letter starts at)
+        self.plans = OrderedDict()
+        self.plans_lock = threading.Lock()
+        self.holding = False
+        self.held = []
+        self.typeahead_limit = typeahead_limit
+        # Seconds each replayed key was held back, most recent last.
+        self.typeahead_delays = deque(maxlen=1000)
+        # The keyboard package can only suppress keys on Windows.
+        self.capture_typeahead = capture_typeahead and os.name == 'nt'
+        if listen:
+            keyboard.hook(self.filter, suppress=True)
+        self.thread = threading.Thread(target=self.run, name='injector', daemon=True)
+        self.thread.start()
+
+    def replace(self, delete_count, response, suffix='', skip=0, rate=AUTO, done=None):
+        """
+        Queues deleting `delete_count` characters, then typing `response`
+        followed by `suffix`, leaving out their first `skip` characters.
+        `rate` overrides the pacing, in characters per second (None for
+        none at all). `done` is called, on the injector's thread, once the
+        job is over.
+        """
+        self.jobs.put(((delete_count, response, suffix, skip, rate), done))
+
+    def wait(self):
+        """ Blocks until every queued job has been typed. """
+        self.jobs.join()
+
+    def cancel(self):
+        """ Stops the job being typed, if any, after its current chunk. """
+        if self.busy:
+            self.cancelled.set()
+
+    def add_progress_listener(self, callback):
+        self.progress_listeners.append(callback)
+
+    def report_dropped(self):
+        """ Tells that the last expansion, if recent, lost characters on the way. """
+        last_paced = self.last_paced
+        if last_paced and time.time() - last_paced[1] < self.report_window:
+            self.last_paced = None
+            self.pacing.dropped(last_paced[0])
+
+    def run(self):
+        while True:
+            job, done = self.jobs.get()
+            self.cancelled.clear()
+            self.busy = True
+            with self.lock:
+                self.holding = self.capture_typeahead
+            try:
+                self.inject(*job)
+            except Exception as e:
+                print(f"Error typing expansion: {e}")
+            finally:
+                self.busy = False
+                self.replay_typeahead()
+                if done:
+                    done()
+                self.jobs.task_done()
+
+    def inject(self, delete_count, response, suffix='', skip=0, rate=AUTO):
+        app = None
+        automatic = rate == AUTO
+        paced = automatic and self.pacing is not None
+        if automatic:
+            app = foreground_app()
+            rate = self.pacing.rate(app) if self.pacing else None
+        if (automatic and self.clipboard and self.pastes_faster(len(response) + len(suffix) - skip, rate)
+                and self.paste(delete_count, (response + suffix)[skip:])):
+            return
+
+        job_start = time.perf_counter()
+        layout = keyboard_layout()
+        plan = self.keys.tap('backspace', delete_count)
+        # Where each character to type starts in the plan, and where it ends.
+        starts = [len(plan)]
+        for text in (response, suffix):
+            text_plan, text_starts = self.compiled(text, layout)
+            first = min(skip, len(text))
+            offset = len(plan) - text_starts[first]
+            plan += text_plan[text_starts[first]:]
+            starts += [offset + start for start in text_starts[first + 1:]]
+            skip = max(skip - len(text), 0)
+
+        # Each chunk, the deletions going with the first, is sent as one
+        # batch.
+        chunk_size = self.chunk_size if rate is None else self.paced_chunk_size
+        total = len(starts) - 1
+        typed = position = 0
+        while True:
+            end = min(typed + chunk_size, total)
+            start_time = time.perf_counter()
+            self.keys.send(plan[position:starts[end]])
+            if self.listening:
+                self.keys.wait_delivered(self.keys.echo_timeout)
+            elapsed = time.perf_counter() - start_time
+            self.chunk_times.append((end - typed, elapsed))
+            pause = (end - typed) / (rate or self.unpaced_rate) - elapsed
+            typed, position = end, starts[end]
+            for callback in self.progress_listeners:
+                callback(typed, total)
+            if typed == total:
+                break
+            # Wait out the rest of the chunk's time first; cancelling cuts
+            # the wait short.
+            if self.cancelled.wait(max(pause, 0)):
+                print(f"Expansion cancelled after {typed} of {total} characters")
+                return
+
+        if rate is None and total >= self.min_measured_length:
+            self.char_cost = moving_average(self.char_cost, (time.perf_counter() - job_start) / total)
+        if paced:
+            if rate is not None:
+                # Only paced jobs can be blamed for dropped characters;
+                # an undo after an unpaced one is most likely just an undo.
+                self.last_paced = (app, time.time())
+            self.pacing.succeeded(app)
+
+    def pastes_faster(self, length, rate):
+        # Typing can't go faster than its rate, unpaced_rate when not
+        # paced, and costs at least what it was measured at.
+        char_cost = max(self.char_cost or 0, 1 / (rate or self.unpaced_rate))
+        return length * char_cost > self.paste_cost
+
+    def paste(self, delete_count, text):
+        """ Pastes `text` in place of `delete_count` characters; False if the clipboard couldn't be set. """
+        start_time = time.perf_counter()
+        try:
+            backup = self.clipboard.backup()
+        except Exception as e:
+            print(f"Typing instead of pasting: {e}")
+            return False
+        try:
+            self.clipboard.set_text(text)
+        except Exception as e:
+            print(f"Typing instead of pasting: {e}")
+            self.restore_clipboard(backup)
+            return False
+        try:
+            self.keys.send(self.keys.tap('backspace', delete_count) + self.keys.hotkey(self.paste_hotkey))
+            if self.listening:
+                self.keys.wait_delivered(self.keys.echo_timeout)
+            # The application reads the clipboard when it gets to the paste.
+            time.sleep(self.paste_settle)
+        finally:
+            self.restore_clipboard(backup)
+        self.paste_cost = moving_average(self.paste_cost, time.perf_counter() - start_time)
+        for callback in self.progress_listeners:
+            callback(len(text), len(text))
+        return True
+
+    def restore_clipboard(self, backup):
+        try:
+            self.clipboard.restore(backup)
+        except Exception as e:
+            print(f"Error restoring the clipboard: {e}")
+
+    def compiled(self, text, layout):
+        key = (text, layout)
+        with self.plans_lock:
+            compiled = self.plans.get(key)
+            if compiled is not None:
+                self.plans.move_to_end(key)
+                return compiled
+        plan, starts = self.keys.compile(text)
+        with self.plans_lock:
+            self.plans[key] = plan, starts
+            while len(self.plans) > self.plan_cache_size:
+                self.plans.popitem(last=False)
+        return plan, starts
+
+    def forget(self, text):
+        """ Drops the plans compiled for `text`, e.g. a response that was edited. """
+        with self.plans_lock:
+            for key in [key for key in self.plans if key[0] == text]:
+                del self.plans[key]
+
+    def is_own(self, event):
+        """ Whether `event` is one of the injector's keys coming back. """
+        return getattr(event, 'injected', False)
+
+    def filter(self, event):
+        # Blocking hook, called for every key event before any handler sees
+        # it. Returning False suppresses the key. Replayed keys go through.
+        sent = self.keys.match(event)
+        if sent == self.keys.ECHO:
+            # The application gets it, handlers can tell with is_own.
+            event.injected = True
+            return True
+        if sent is None and not self.hold(event):
+            return False
+        self.keys.track(event)
+        return True
+
+    def hold(self, event):
+        with self.lock:
+            if not self.holding:
+                return True
+            if event.name == self.cancel_key:
+                # Meant for us, the application doesn't get it.
+                if event.event_type == keyboard.KEY_DOWN:
+                    self.cancel()
+                return False
+            if len(self.held) >= self.typeahead_limit:
+                return True
+            self.held.append(event)
+            return False
+
+    def replay_typeahead(self):
+        # Keys typed during the replay itself are held too, so loop until
+        # nothing is left before letting keys through again.
+        while True:
+            with self.lock:
+                held, self.held = self.held, []
+                if not held:
+                    self.holding = False
+                    return
+            self.keys.replay(held)
+            now = time.time()
+            self.typeahead_delays.extend(now - event.time for event in held)
+
+    def typeahead_latency(self):
+        """ (count, median, max) seconds replayed keys were held back. """
+        delays = sorted(self.typeahead_delays)
+        if not delays:
+            return 0, 0.0, 0.0
+        return len(delays), delays[len(delays) // 2], delays[-1]
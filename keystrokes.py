@@ -0,0 +1,472 @@
+import ctypes
+import itertools
+import os
+import re
+import struct
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+
+import keyboard
+
+# struct input_event from linux/input.h, and the event types used here.
+EVENT_FORMAT = struct.Struct('llHHI')
+EV_SYN = 0x00
+EV_KEY = 0x01
+# EVIOCGLED(1), which reads the LED bits of an input device, and the caps
+# lock bit.
+EVIOCGLED = 0x80014519
+LED_CAPSL = 0x01
+
+# Keysym types, from linux/keyboard.h, whose value holds a latin-1
+# character in its low byte.
+KT_LATIN = 0
+KT_LETTER = 11
+# Modifiers of the `dumpkeys` columns that type characters, in order.
+DUMPKEYS_LEVELS = [(), ('shift',), ('alt gr',), ('alt gr', 'shift')]
+
+
+def dumpkeys_chars(keys_only, long_info):
+    """
+    Parses the output of `dumpkeys --keys-only` and `dumpkeys --long-info`
+    into {character: [(scan_code, modifiers)]}, for every printable
+    character a key types on its plain, shift and alt gr levels. Keys
+    needing the fewest modifiers come first.
+    """
+    # The character each symbol types, from the table of symbol values.
+    symbol_chars = {}
+    for str_value, symbol in re.findall(r'^0x([0-9a-fA-F]+)\s+(\S+)$', long_info, re.MULTILINE):
+        value = int(str_value, 16)
+        if value >> 8 in (KT_LATIN, KT_LETTER):
+            symbol_chars.setdefault(symbol, chr(value & 0xff))
+
+    chars = {}
+    for str_scan_code, symbols in re.findall(r'^keycode\s+(\d+)\s+=(.*?)$', keys_only, re.MULTILINE):
+        for symbol, modifiers in zip(symbols.split(), DUMPKEYS_LEVELS):
+            symbol = symbol.lstrip('+')
+            if symbol.startswith('U+'):
+                try:
+                    char = chr(int(symbol[2:], 16))
+                except ValueError:
+                    continue
+            else:
+                char = symbol_chars.get(symbol)
+            if char and char.isprintable():
+                chars.setdefault(char, []).append((int(str_scan_code), modifiers))
+    for entries in chars.values():
+        entries.sort(key=lambda entry: len(entry[1]))
+    return chars
+
+
+class SendInputOutput:
+    """
+    Windows: a whole batch goes to the OS as one SendInput array, built
+    from the keyboard package's own backend structures.
+
+    Batches are lists of (scan_code, is_down) pairs, with a character
+    instead of a pair where it is typed as explicit unicode.
+    """
+
+    def __init__(self):
+        from keyboard import _winkeyboard
+        self.backend = _winkeyboard
+        # Fail here, not on the first expansion, if the backend changed.
+        for name in ('INPUT', 'KEYBDINPUT', 'SendInput', 'scan_code_to_vk'):
+            getattr(self.backend, name)
+
+    def key_inputs(self, code, is_down):
+        backend = self.backend
+        flags = 0 if is_down else backend.KEYEVENTF_KEYUP
+        if code == 541:
+            # Alt gr is made of ctrl+alt, like the backend sends it.
+            keys = [(0x11, code), (0x12, code)]
+        elif code > 0:
+            keys = [(backend.scan_code_to_vk.get(code, 0), code)]
+        else:
+            # Negative codes stand for virtual keys without a scan code.
+            keys = [(-code, 0)]
+        return [backend.INPUT(backend.INPUT_KEYBOARD, backend._INPUTunion(ki=backend.KEYBDINPUT(vk, scan_code, flags, 0, None)))
+                for vk, scan_code in keys]
+
+    def unicode_inputs(self, letter):
+        backend = self.backend
+        units = letter.encode('utf-16le')
+        codes = [units[i] + (units[i + 1] << 8) for i in range(0, len(units), 2)]
+        return [backend.INPUT(backend.INPUT_KEYBOARD, backend._INPUTunion(ki=backend.KEYBDINPUT(0, code, backend.KEYEVENTF_UNICODE | flags, 0, None)))
+                for flags in (0, backend.KEYEVENTF_KEYUP) for code in codes]
+
+    def send(self, batch):
+        self.backend.init()
+        inputs = []
+        for entry in batch:
+            if isinstance(entry, tuple):
+                inputs += self.key_inputs(*entry)
+            else:
+                inputs += self.unicode_inputs(entry)
+        if inputs:
+            self.backend.SendInput(len(inputs), (self.backend.INPUT * len(inputs))(*inputs), ctypes.sizeof(self.backend.INPUT))
+
+
+class UinputOutput:
+    """
+    Linux: batches are packed into a preallocated buffer and reach the
+    keyboard package's uinput device in a single write. A sync report,
+    which makes other programs take in the events before it, follows every
+    whole keystroke or chord (once each key pressed since the last report
+    is up again) and ends the batch.
+
+    `send(batch, flush=False)` keeps adding to the same write until
+    `flush` is called. `file` replaces the device, e.g. with one counting
+    the writes in tests.
+    """
+
+    def __init__(self, file=None):
+        from keyboard import _nixkeyboard
+        self.backend = _nixkeyboard
+        for name in ('build_device', 'type_unicode'):
+            getattr(self.backend, name)
+        self._file = file
+        self.buffer = bytearray(EVENT_FORMAT.size * 64)
+        self.length = 0
+        # Keys pressed since the last sync report.
+        self.unsynced = set()
+
+    @property
+    def file(self):
+        if self._file is None:
+            self.backend.build_device()
+            device = self.backend.device
+            # Either the uinput device itself or the aggregate writing to it.
+            self._file = getattr(device, 'output', device).output_file
+        return self._file
+
+    def pack(self, seconds, microseconds, type, code, value):
+        end = self.length + EVENT_FORMAT.size
+        if end > len(self.buffer):
+            self.buffer.extend(bytes(len(self.buffer)))
+        EVENT_FORMAT.pack_into(self.buffer, self.length, seconds, microseconds, type, code, value)
+        self.length = end
+
+    def send(self, batch, flush=True):
+        seconds, fraction = divmod(time.time(), 1)
+        seconds, microseconds = int(seconds), int(fraction * 1e6)
+        unsynced = self.unsynced
+        synced = True
+        for entry in batch:
+            if not isinstance(entry, tuple):
+                self.sync(seconds, microseconds, synced)
+                synced = True
+                self.flush()
+                self.backend.type_unicode(entry)
+                continue
+            scan_code, is_down = entry
+            self.pack(seconds, microseconds, EV_KEY, scan_code, int(is_down))
+            synced = False
+            if is_down:
+                unsynced.add(scan_code)
+            elif scan_code in unsynced:
+                unsynced.discard(scan_code)
+                if not unsynced:
+                    self.pack(seconds, microseconds, EV_SYN, 0, 0)
+                    synced = True
+        self.sync(seconds, microseconds, synced)
+        if flush:
+            self.flush()
+
+    def sync(self, seconds, microseconds, synced):
+        if not synced:
+            self.pack(seconds, microseconds, EV_SYN, 0, 0)
+            self.unsynced.clear()
+
+    def flush(self):
+        """ Sends every buffered event to the device, with a single write. """
+        if not self.length:
+            return
+        self.file.write(memoryview(self.buffer)[:self.length])
+        self.file.flush()
+        self.length = 0
+
+
+class KeyboardOutput:
+    """
+    Any platform: one call to the keyboard package's backend per event.
+    The backend is called directly, not through `keyboard.press`, which
+    would keep the events away from the package's own hooks. Used where
+    there is no faster output.
+    """
+
+    def send(self, batch):
+        backend = keyboard._os_keyboard
+        for entry in batch:
+            if isinstance(entry, tuple):
+                scan_code, is_down = entry
+                if is_down:
+                    backend.press(scan_code)
+                else:
+                    backend.release(scan_code)
+            else:
+                backend.type_unicode(entry)
+
+
+class RecordingOutput:
+    """ Keeps every batch it is given instead of sending it, for tests. """
+
+    def __init__(self):
+        self.batches = []
+
+    def send(self, batch):
+        self.batches.append(list(batch))
+
+    @property
+    def events(self):
+        """ Every entry sent so far, in order. """
+        return [entry for batch in self.batches for entry in batch]
+
+
+class SystemKeymap:
+    """
+    Keys of the current layout, as the installed keyboard package maps
+    them. `exact` is the same as in `keyboard.write`.
+
+    The package only knows the characters Linux keys are named after. With
+    `linux`, the rest of what the layout types, alt gr levels included, is
+    read from `dumpkeys` (see dumpkeys_chars), and characters no key types
+    get a ctrl+shift+u sequence, compiled once per character.
+    """
+
+    def __init__(self, exact=None, linux=None):
+        self.exact = os.name == 'nt' if exact is None else exact
+        self.linux = sys.platform.startswith('linux') if linux is None else linux
+        self._chars = None
+        self.unicode_plans = {}
+
+    @property
+    def chars(self):
+        if self._chars is None:
+            try:
+                self._chars = dumpkeys_chars(subprocess.check_output(['dumpkeys', '--keys-only'], universal_newlines=True),
+                                             subprocess.check_output(['dumpkeys', '--long-info'], universal_newlines=True))
+            except (OSError, subprocess.CalledProcessError) as e:
+                print(f"Error reading the keyboard layout: {e}")
+                self._chars = {}
+        return self._chars
+
+    def scan_code(self, name):
+        return keyboard.key_to_scan_codes(name)[0]
+
+    def is_modifier(self, scan_code):
+        return keyboard.is_modifier(scan_code)
+
+    def tap(self, name):
+        scan_code = self.scan_code(name)
+        return [(scan_code, True), (scan_code, False)]
+
+    def letter_plan(self, letter):
+        """ The batch entries typing `letter`, like `keyboard.write` would. """
+        # Window's typing of unicode characters is quite efficient and should be preferred.
+        if self.exact:
+            if letter in '\n\b':
+                return self.tap(letter)
+            return [letter]
+        key = self.key_for(letter)
+        if key is None:
+            return self.unicode_plan(letter) if self.linux else [letter]
+        scan_code, modifiers = key
+        modifier_codes = [self.scan_code(modifier) for modifier in modifiers]
+        return ([(modifier, True) for modifier in modifier_codes]
+                + [(scan_code, True), (scan_code, False)]
+                + [(modifier, False) for modifier in reversed(modifier_codes)])
+
+    def key_for(self, letter):
+        """ (scan_code, modifiers) of the key typing `letter`, None if there is none. """
+        try:
+            return next(iter(keyboard._os_keyboard.map_name(keyboard.normalize_name(letter))))
+        except (KeyError, ValueError, StopIteration):
+            pass
+        if self.linux and self.chars.get(letter):
+            return self.chars[letter][0]
+        return None
+
+    def unicode_plan(self, letter):
+        """ The entries typing `letter` as ctrl+shift+u and its code point in hexadecimal. """
+        plan = self.unicode_plans.get(letter)
+        if plan is None:
+            prefix = [self.scan_code(key) for key in ('ctrl', 'shift', 'u')]
+            plan = [(scan_code, True) for scan_code in prefix]
+            for digit in format(ord(letter), 'x'):
+                plan += self.tap(digit)
+            plan += [(scan_code, False) for scan_code in prefix]
+            self.unicode_plans[letter] = plan
+        return plan
+
+
+class Keystrokes:
+    """
+    Types text as batches of key events, each sent with a single call to
+    `output` (see `system_output`). Texts are compiled to their events
+    with `compile` once, so the key names in them are only looked up in
+    `keymap` (see SystemKeymap) then.
+
+    Like `keyboard.write`, sending releases the keys the user is holding
+    first and presses held modifiers again afterwards, but the releases,
+    the plan and the restored modifiers all go out in the same batch, so
+    nothing sees a half-typed state. Held keys are followed by `track`,
+    which has to be called from a keyboard hook for every real key event.
+
+    The events sent come back to keyboard hooks like real ones. Every key
+    event sent is expected back for `echo_timeout` seconds, and `match`
+    tells a hook whether the event it got is one of them: ECHO for our own
+    keys, REPLAY for real keys sent again with `replay`. Only the
+    `echo_lookahead` oldest expected events are compared, in case some
+    never arrive, and nothing at all while none are expected. Once all of
+    them came back the OS has taken them in, see `wait_delivered`.
+    """
+
+    ECHO = 'echo'
+    REPLAY = 'replay'
+    echo_timeout = 1.0
+    echo_lookahead = 8
+
+    def __init__(self, output=None, keymap=None):
+        self.output = system_output() if output is None else output
+        self.keymap = SystemKeymap() if keymap is None else keymap
+        self.lock = threading.Lock()
+        # Scan codes of the keys held down.
+        self.pressed = set()
+        # (scan_code, is_down, deadline, ECHO or REPLAY) of the events sent
+        # and not seen back yet.
+        self.echoes = deque()
+        # Set while no events are expected back.
+        self.delivered = threading.Event()
+        self.delivered.set()
+
+    def tap(self, name, count=1):
+        """ The entries pressing and releasing key `name` `count` times. """
+        return self.keymap.tap(name) * count
+
+    def hotkey(self, hotkey):
+        """ The entries pressing the keys of `hotkey`, e.g. 'ctrl+v', then releasing them. """
+        scan_codes = [self.keymap.scan_code(name) for name in hotkey.split('+')]
+        return [(scan_code, True) for scan_code in scan_codes] + [(scan_code, False) for scan_code in reversed(scan_codes)]
+
+    def compile(self, text):
+        """
+        Returns (plan, starts): the entries typing `text`, and the index in
+        the plan each of its letters starts at, followed by len(plan).
+        """
+        plan = []
+        starts = [0]
+        for letter in text:
+            plan += self.keymap.letter_plan(letter)
+            starts.append(len(plan))
+        return plan, starts
+
+    def send(self, plan, restore_state=True):
+        """
+        Sends `plan` as one transaction, see above. Held modifiers stay
+        released if not `restore_state`.
+        """
+        with self.lock:
+            pressed = sorted(self.pressed)
+        restored = [scan_code for scan_code in pressed if self.keymap.is_modifier(scan_code)] if restore_state else []
+        self.send_batch([(scan_code, False) for scan_code in pressed] + list(plan) + [(scan_code, True) for scan_code in restored])
+
+    def replay(self, events):
+        """
+        Sends key events the user typed, e.g. ones a hook held back, again
+        as they were. They go through hooks as real keys, see `match`.
+        """
+        self.send_batch([(event.scan_code, event.event_type == keyboard.KEY_DOWN) for event in events], self.REPLAY)
+
+    def send_batch(self, batch, kind=ECHO):
+        # Expected before sending: on Windows hooks see the events before
+        # the call returns. Characters typed as unicode don't come back.
+        deadline = time.monotonic() + self.echo_timeout
+        with self.lock:
+            self.echoes.extend(entry + (deadline, kind) for entry in batch if isinstance(entry, tuple))
+            if self.echoes:
+                self.delivered.clear()
+        self.output.send(batch)
+
+    def wait_delivered(self, timeout):
+        """
+        Blocks until every event sent came back through the keyboard hooks,
+        or `timeout` seconds passed. Returns whether they all did.
+        """
+        return self.delivered.wait(timeout)
+
+    def replace_text(self, delete_count, text):
+        """
+        Deletes `delete_count` characters with backspace and types `text`
+        in their place, as one transaction.
+        """
+        self.send(self.tap('backspace', delete_count) + self.compile(text)[0])
+
+    def match(self, event):
+        """
+        ECHO or REPLAY if `event`, seen by a keyboard hook, is one we sent
+        coming back, None otherwise.
+        """
+        if not self.echoes:
+            return None
+        key = (event.scan_code, event.event_type == keyboard.KEY_DOWN)
+        now = time.monotonic()
+        with self.lock:
+            echoes = self.echoes
+            while echoes and echoes[0][2] < now:
+                echoes.popleft()
+            for i, echo in enumerate(itertools.islice(echoes, self.echo_lookahead)):
+                if echo[:2] == key:
+                    # Ones expected before it were lost on the way.
+                    for _ in range(i + 1):
+                        echoes.popleft()
+                    break
+            else:
+                echo = None
+            if not echoes:
+                self.delivered.set()
+        return echo and echo[3]
+
+    def track(self, event):
+        with self.lock:
+            if event.event_type == keyboard.KEY_DOWN:
+                self.pressed.add(event.scan_code)
+            else:
+                self.pressed.discard(event.scan_code)
+
+
+def caps_lock_on():
+    """
+    Linux: whether caps lock is on, read from the keyboards' LEDs through
+    the keyboard package's devices. None where it can't be told.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        import fcntl
+        from keyboard import _nixkeyboard
+        _nixkeyboard.build_device()
+        leds = bytearray(1)
+        for device in getattr(_nixkeyboard.device, 'devices', []):
+            fcntl.ioctl(device.input_file, EVIOCGLED, leds)
+            if leds[0] & LED_CAPSL:
+                return True
+        return False
+    except (ImportError, OSError, AttributeError, AssertionError) as e:
+        # The package asserts when it can't open any device.
+        print(f"Error reading the caps lock state: {e}")
+        return None
+
+
+def system_output():
+    """ The fastest output this platform has. """
+    try:
+        if os.name == 'nt':
+            return SendInputOutput()
+        if sys.platform.startswith('linux'):
+            return UinputOutput()
+    except (ImportError, AttributeError) as e:
+        print(f"Sending keys one at a time: {e}")
+    return KeyboardOutput()
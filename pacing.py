@@ -0,0 +1,110 @@
+import json
+import os
+import threading
+
+# Rates the self-test tries, in characters per second, fastest first. None
+# sends the whole text at once.
+CALIBRATION_RATES = (None, 2000, 1000, 500, 250, 120, 60)
+# Typed into the echo target by the self-test: shifted and unshifted keys,
+# digits and punctuation.
+CALIBRATION_TEXT = "The quick brown fox jumps over the lazy dog. 0123456789 (Pack my box!)"
+# Rates never drop below this, and grow back to unpaced past UNPACED_RATE.
+MIN_RATE = 30
+UNPACED_RATE = 4000
+
+
+class PacingTable:
+    """
+    Typing rate for each application expansions are typed into, in
+    characters per second, None meaning as fast as possible.
+
+    An application starts at the rate the self-test calibrated (`default`).
+    Its rate halves every time characters were dropped in it, then grows
+    back by a quarter with every expansion that went through, up to the
+    calibrated rate again. Rates are kept in `path` across runs.
+    """
+
+    def __init__(self, path='pacing.json'):
+        self.path = path
+        self.default = None
+        self.rates = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as f:
+                    data = json.load(f)
+                self.default = data.get('default')
+                self.rates = data.get('applications', {})
+        except Exception as e:
+            print(f"Error loading pacing: {e}")
+
+    def save(self):
+        try:
+            with open(self.path, 'w') as f:
+                json.dump({'default': self.default, 'applications': self.rates}, f, indent=2)
+        except Exception as e:
+            print(f"Error saving pacing: {e}")
+
+    def rate(self, app):
+        # Applications that can't be told apart share the '' entry.
+        return self.rates.get(app or '', self.default)
+
+    def calibrated(self, rate):
+        """ Stores the rate the self-test found, capping every application at it. """
+        with self.lock:
+            self.default = rate
+            if rate is not None:
+                self.rates = {app: min(app_rate, rate) for app, app_rate in self.rates.items()
+                              if app_rate is not None and app_rate < rate}
+            self.save()
+
+    def dropped(self, app):
+        """ Backs off after characters typed into `app` went missing. """
+        with self.lock:
+            rate = self.rate(app)
+            self.rates[app or ''] = max(MIN_RATE, (UNPACED_RATE if rate is None else rate) // 2)
+            self.save()
+
+    def succeeded(self, app):
+        """ Speeds `app` up again after an expansion went through. """
+        with self.lock:
+            rate = self.rates.get(app or '')
+            if rate is None:
+                return
+            rate += max(rate // 4, 1)
+            if self.default is not None and rate >= self.default or self.default is None and rate >= UNPACED_RATE:
+                # Back at the calibrated rate.
+                del self.rates[app or '']
+            else:
+                self.rates[app or ''] = rate
+            self.save()
+
+
+class Calibration:
+    """
+    Self-test: `text` is typed into a local echo target at each of `rates`
+    in turn, fastest first, until it comes through intact. Type it at
+    `rate`, read the echo back and hand it to `passed`; once that returns
+    True, `result` is the rate found, or the slowest one if none worked.
+    """
+
+    def __init__(self, rates=CALIBRATION_RATES, text=CALIBRATION_TEXT):
+        self.rates = rates
+        self.text = text
+        self.index = 0
+        self.result = None
+
+    @property
+    def rate(self):
+        return self.rates[self.index]
+
+    def passed(self, echo):
+        """ Takes the echo of the text typed at `rate`; returns whether calibration is done. """
+        if echo == self.text or self.index == len(self.rates) - 1:
+            self.result = self.rate
+            return True
+        self.index += 1
+        return False
@@ -0,0 +1,276 @@
+import time
+import unittest
+from unittest import mock
+
+from keyboard import KEY_DOWN, KEY_UP, KeyboardEvent
+
+from clipboard import MemoryClipboard
+from injector import Injector
+from pacing import PacingTable
+from test_keystrokes import CTRL, SHIFT, events, fake_keys
+
+
+def fake_injector(**kwargs):
+    return Injector(keys=fake_keys(), listen=False, **kwargs)
+
+
+class TestWorker(unittest.TestCase):
+    def test_jobs_are_typed_in_order(self):
+        injector = fake_injector()
+        injector.replace(2, 'ok')
+        injector.replace(0, 'no')
+        injector.wait()
+        # The deletions and the text of a job in one batch.
+        self.assertEqual(injector.keys.output.batches, [[(14, True), (14, False)] * 2 + fake_keys().compile('ok')[0],
+                                                        fake_keys().compile('no')[0]])
+
+    def test_errors_dont_stop_the_worker(self):
+        injector = fake_injector()
+        send = injector.keys.output.send
+
+        def output(batch):
+            if batch == fake_keys().compile('x')[0]:
+                raise OSError('x')
+            send(batch)
+
+        injector.keys.output.send = output
+        with mock.patch('builtins.print'):
+            injector.replace(0, 'x')
+            injector.replace(0, 'ok')
+            injector.wait()
+        self.assertEqual(injector.keys.output.batches, [fake_keys().compile('ok')[0]])
+
+
+class TestPlans(unittest.TestCase):
+    def setUp(self):
+        self.injector = fake_injector()
+
+    def test_skip(self):
+        # The first two characters of the response are already on screen.
+        self.injector.replace(2, 'hello', suffix='x', skip=2)
+        self.injector.wait()
+        self.assertEqual(self.injector.keys.output.events,
+                         [(14, True), (14, False)] * 2 + fake_keys().compile('llox')[0])
+
+    def test_skip_into_suffix(self):
+        self.injector.replace(0, 'ab', suffix='cd', skip=3)
+        self.injector.wait()
+        self.assertEqual(self.injector.keys.output.events, fake_keys().compile('d')[0])
+
+    def test_plans_are_cached(self):
+        compiled = []
+        compile = self.injector.keys.compile
+        self.injector.keys.compile = lambda text: compiled.append(text) or compile(text)
+        for _ in range(3):
+            self.injector.replace(0, 'ab')
+        self.injector.wait()
+        self.assertEqual(compiled, ['ab', ''])
+
+    def test_cache_is_bounded(self):
+        self.injector.plan_cache_size = 2
+        for text in ('a', 'b', 'c'):
+            self.injector.compiled(text, None)
+        self.assertEqual([text for text, layout in self.injector.plans], ['b', 'c'])
+
+    def test_forget(self):
+        self.injector.compiled('ab', None)
+        self.injector.compiled('cd', None)
+        self.injector.forget('ab')
+        self.assertEqual([text for text, layout in self.injector.plans], ['cd'])
+
+
+class TestFilter(unittest.TestCase):
+    def test_held_keys_are_tracked(self):
+        injector = fake_injector()
+        self.assertTrue(injector.filter(KeyboardEvent(KEY_DOWN, SHIFT)))
+        self.assertTrue(injector.filter(KeyboardEvent(KEY_DOWN, 97)))
+        self.assertTrue(injector.filter(KeyboardEvent(KEY_UP, 97)))
+        self.assertEqual(injector.keys.pressed, {SHIFT})
+
+    def test_own_keys_are_marked(self):
+        injector = fake_injector()
+        injector.keys.send(injector.keys.tap('a'))
+        echoes = events(injector.keys.tap('a'))
+        self.assertTrue(all(injector.filter(event) for event in echoes))
+        self.assertTrue(all(injector.is_own(event) for event in echoes))
+
+    def test_real_keys_are_not_marked(self):
+        injector = fake_injector()
+        event = KeyboardEvent(KEY_DOWN, 97)
+        self.assertTrue(injector.filter(event))
+        self.assertFalse(injector.is_own(event))
+
+    def test_own_keys_are_not_tracked_as_held(self):
+        injector = fake_injector()
+        injector.filter(KeyboardEvent(KEY_DOWN, SHIFT))
+        injector.keys.send([(SHIFT, True)], restore_state=False)
+        injector.filter(KeyboardEvent(KEY_UP, SHIFT))
+        injector.filter(KeyboardEvent(KEY_DOWN, SHIFT))
+        self.assertEqual(injector.keys.pressed, {SHIFT})
+
+    def test_jobs_release_held_keys(self):
+        injector = fake_injector()
+        injector.filter(KeyboardEvent(KEY_DOWN, SHIFT))
+        injector.replace(0, 'a')
+        injector.wait()
+        self.assertEqual(injector.keys.output.events, [(SHIFT, False), (97, True), (97, False), (SHIFT, True)])
+
+
+class TestTypeahead(unittest.TestCase):
+    def setUp(self):
+        self.injector = fake_injector()
+        # As while a job is being typed with capture_typeahead.
+        self.injector.holding = True
+
+    def test_keys_are_held_and_replayed(self):
+        typed = [KeyboardEvent(KEY_DOWN, CTRL), KeyboardEvent(KEY_DOWN, 122), KeyboardEvent(KEY_UP, 122), KeyboardEvent(KEY_UP, CTRL)]
+        for event in typed:
+            event.time = time.time()
+        self.assertEqual([self.injector.filter(event) for event in typed], [False] * 4)
+        self.injector.replay_typeahead()
+        self.assertFalse(self.injector.holding)
+        self.assertEqual(self.injector.keys.output.batches, [[(CTRL, True), (122, True), (122, False), (CTRL, False)]])
+        self.assertEqual(self.injector.typeahead_latency()[0], 4)
+
+    def test_replayed_keys_pass_as_real(self):
+        self.injector.keys.replay([KeyboardEvent(KEY_DOWN, CTRL)])
+        # While holding, only the replayed copy goes through.
+        self.assertTrue(self.injector.filter(KeyboardEvent(KEY_DOWN, CTRL)))
+        self.assertFalse(self.injector.filter(KeyboardEvent(KEY_DOWN, CTRL)))
+
+    def test_keys_during_replay_are_held(self):
+        self.injector.filter(KeyboardEvent(KEY_DOWN, 97, time=time.time()))
+        replay = self.injector.keys.replay
+
+        def typing_during_replay(held):
+            replay(held)
+            self.injector.filter(KeyboardEvent(KEY_DOWN, 98, time=time.time()))
+            self.injector.keys.replay = replay
+
+        self.injector.keys.replay = typing_during_replay
+        self.injector.replay_typeahead()
+        self.assertEqual(self.injector.keys.output.batches, [[(97, True)], [(98, True)]])
+
+    def test_limit(self):
+        self.injector.typeahead_limit = 1
+        self.assertFalse(self.injector.filter(KeyboardEvent(KEY_DOWN, 97, time=time.time())))
+        self.assertTrue(self.injector.filter(KeyboardEvent(KEY_DOWN, 98, time=time.time())))
+
+    def test_cancel_key_is_not_held(self):
+        self.injector.busy = True
+        escape = KeyboardEvent(KEY_DOWN, 1, name='esc')
+        self.assertFalse(self.injector.filter(escape))
+        self.assertTrue(self.injector.cancelled.is_set())
+        self.assertEqual(self.injector.held, [])
+
+
+class TestChunks(unittest.TestCase):
+    def setUp(self):
+        self.injector = fake_injector()
+        self.injector.chunk_size = 10
+
+    def test_chunks(self):
+        progress = []
+        self.injector.add_progress_listener(lambda typed, total: progress.append((typed, total)))
+        self.injector.replace(0, 'a' * 25)
+        self.injector.wait()
+        self.assertEqual([len(batch) for batch in self.injector.keys.output.batches], [20, 20, 10])
+        self.assertEqual(progress, [(10, 25), (20, 25), (25, 25)])
+        self.assertEqual([characters for characters, seconds in self.injector.chunk_times], [10, 10, 5])
+
+    def test_deletions_go_with_the_first_chunk(self):
+        self.injector.replace(2, 'a' * 15, skip=1)
+        self.injector.wait()
+        self.assertEqual([len(batch) for batch in self.injector.keys.output.batches], [24, 8])
+
+    def test_cancel_between_chunks(self):
+        self.injector.add_progress_listener(lambda typed, total: self.injector.cancel())
+        self.injector.replace(0, 'a' * 25)
+        self.injector.wait()
+        self.assertEqual(len(self.injector.keys.output.batches), 1)
+
+    def test_unpaced_chunks_are_spaced(self):
+        self.injector.unpaced_rate = 1000
+        start_time = time.perf_counter()
+        self.injector.replace(0, 'a' * 30)
+        self.injector.wait()
+        # Two pauses of 10 characters at 1000 per second.
+        self.assertGreaterEqual(time.perf_counter() - start_time, 0.02)
+
+
+class TestPacing(unittest.TestCase):
+    def setUp(self):
+        self.pacing = PacingTable(path='')
+        self.pacing.save = lambda: None
+        self.injector = fake_injector(pacing=self.pacing)
+
+    def test_done_callback(self):
+        done = []
+        self.injector.replace(0, 'ab', rate=None, done=lambda: done.append(True))
+        self.injector.wait()
+        self.assertEqual(done, [True])
+
+    def test_paced_chunks(self):
+        self.injector.paced_chunk_size = 4
+        self.injector.replace(0, 'a' * 10, rate=1000)
+        self.injector.wait()
+        self.assertEqual([len(batch) // 2 for batch in self.injector.keys.output.batches], [4, 4, 2])
+
+    def test_dropped_after_paced_job(self):
+        self.pacing.default = 1000
+        self.injector.replace(0, 'ab')
+        self.injector.wait()
+        self.injector.report_dropped()
+        self.assertEqual(self.pacing.rate(None), 500)
+
+    def test_undo_after_unpaced_job(self):
+        self.injector.replace(0, 'ab')
+        self.injector.wait()
+        self.injector.report_dropped()
+        self.assertIsNone(self.pacing.rate(None))
+
+
+class BusyClipboard(MemoryClipboard):
+    def set_text(self, text):
+        raise OSError('clipboard busy')
+
+
+class TestPaste(unittest.TestCase):
+    def setUp(self):
+        self.injector = fake_injector(clipboard=MemoryClipboard(contents='saved'))
+        self.injector.paste_settle = 0
+        # Pasting costs as much as typing 100 characters.
+        self.injector.paste_cost = 100 / self.injector.unpaced_rate
+
+    def test_long_text_is_pasted(self):
+        self.injector.filter(KeyboardEvent(KEY_DOWN, SHIFT))
+        self.injector.replace(2, 'a' * 150)
+        self.injector.wait()
+        # Held shift released first, so the paste isn't ctrl+shift+v.
+        self.assertEqual(self.injector.keys.output.batches, [[(SHIFT, False), (14, True), (14, False), (14, True), (14, False),
+                                                              (CTRL, True), (118, True), (118, False), (CTRL, False), (SHIFT, True)]])
+        self.assertEqual(self.injector.clipboard.history, ['a' * 150])
+
+    def test_clipboard_is_restored(self):
+        self.injector.replace(0, 'a' * 150)
+        self.injector.wait()
+        self.assertEqual(self.injector.clipboard.contents, 'saved')
+
+    def test_short_text_is_typed(self):
+        self.injector.replace(0, 'a' * 50)
+        self.injector.wait()
+        self.assertEqual(self.injector.clipboard.history, [])
+        self.assertEqual(len(self.injector.keys.output.events), 100)
+
+    def test_typed_when_clipboard_busy(self):
+        self.injector.clipboard = BusyClipboard(contents='saved')
+        self.injector.replace(2, 'a' * 150)
+        self.injector.wait()
+        events = self.injector.keys.output.events
+        self.assertEqual(events[:4], [(14, True), (14, False)] * 2)
+        self.assertEqual(len(events), 4 + 300)
+        self.assertEqual(self.injector.clipboard.contents, 'saved')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,276 @@
+import io
+import types
+import unittest
+
+from keyboard import KEY_DOWN, KEY_UP, KeyboardEvent
+
+from keystrokes import EV_KEY, EV_SYN, EVENT_FORMAT, Keystrokes, RecordingOutput, SystemKeymap, UinputOutput, dumpkeys_chars
+
+SHIFT = 42
+CTRL = 29
+NAMED_KEYS = {'backspace': 14, 'shift': SHIFT, 'ctrl': CTRL, 'enter': 28}
+
+
+class FakeKeymap:
+    """
+    Layout for tests: a-z are the keys with their character code, upper
+    case letters add shift, anything else is typed as unicode.
+    """
+
+    def scan_code(self, name):
+        return NAMED_KEYS[name] if name in NAMED_KEYS else ord(name)
+
+    def is_modifier(self, scan_code):
+        return scan_code in (SHIFT, CTRL)
+
+    def tap(self, name):
+        scan_code = self.scan_code(name)
+        return [(scan_code, True), (scan_code, False)]
+
+    def letter_plan(self, letter):
+        if 'a' <= letter <= 'z':
+            return self.tap(letter)
+        if 'A' <= letter <= 'Z':
+            return [(SHIFT, True)] + self.tap(letter.lower()) + [(SHIFT, False)]
+        return [letter]
+
+
+def fake_keys():
+    return Keystrokes(RecordingOutput(), FakeKeymap())
+
+
+class CountingFile(io.BytesIO):
+    """ Output file counting its write and flush calls, a syscall each on a device. """
+
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+        self.flushes = 0
+
+    def write(self, data):
+        self.writes += 1
+        return super().write(data)
+
+    def flush(self):
+        self.flushes += 1
+
+    def events(self):
+        data = self.getvalue()
+        return [EVENT_FORMAT.unpack_from(data, i)[2:] for i in range(0, len(data), EVENT_FORMAT.size)]
+
+
+class TestOutputs(unittest.TestCase):
+    def test_recording_output(self):
+        output = RecordingOutput()
+        output.send([(30, True), (30, False)])
+        output.send(['é'])
+        self.assertEqual(output.batches, [[(30, True), (30, False)], ['é']])
+        self.assertEqual(output.events, [(30, True), (30, False), 'é'])
+
+    def test_uinput_single_write(self):
+        file = CountingFile()
+        output = UinputOutput(file)
+        output.send([(42, True), (30, True), (30, False), (42, False)])
+        self.assertEqual((file.writes, file.flushes), (1, 1))
+        self.assertEqual([event for event in file.events() if event[0] == EV_KEY],
+                         [(EV_KEY, 42, 1), (EV_KEY, 30, 1), (EV_KEY, 30, 0), (EV_KEY, 42, 0)])
+        self.assertEqual(file.events()[-1], (EV_SYN, 0, 0))
+
+    def test_uinput_sync_at_keystroke_boundaries(self):
+        file = CountingFile()
+        # shift+a, then b.
+        UinputOutput(file).send([(42, True), (30, True), (30, False), (42, False), (48, True), (48, False)])
+        self.assertEqual(file.events(), [(EV_KEY, 42, 1), (EV_KEY, 30, 1), (EV_KEY, 30, 0), (EV_KEY, 42, 0), (EV_SYN, 0, 0),
+                                         (EV_KEY, 48, 1), (EV_KEY, 48, 0), (EV_SYN, 0, 0)])
+
+    def test_uinput_sync_at_batch_end(self):
+        file = CountingFile()
+        # A modifier left pressed, as when restoring one held by the user.
+        UinputOutput(file).send([(30, True), (30, False), (29, True)])
+        self.assertEqual(file.events()[-2:], [(EV_KEY, 29, 1), (EV_SYN, 0, 0)])
+
+    def test_uinput_buffered_until_flush(self):
+        file = CountingFile()
+        output = UinputOutput(file)
+        for _ in range(100):
+            output.send([(30, True), (30, False)], flush=False)
+        self.assertEqual(file.writes, 0)
+        output.flush()
+        self.assertEqual((file.writes, len(file.events())), (1, 300))
+
+    def test_uinput_unicode_flushes_first(self):
+        file = CountingFile()
+        output = UinputOutput(file)
+        typed = []
+        output.backend = types.SimpleNamespace(type_unicode=lambda letter: typed.append((letter, len(file.events()))))
+        output.send([(30, True), (30, False), 'é', (48, True), (48, False)])
+        # The keys before the character reached the device before it.
+        self.assertEqual(typed, [('é', 3)])
+        self.assertEqual(file.writes, 2)
+
+    def test_uinput_empty_batch(self):
+        file = CountingFile()
+        UinputOutput(file).send([])
+        self.assertEqual(file.writes, 0)
+
+
+class TestKeystrokes(unittest.TestCase):
+    def test_compile(self):
+        plan, starts = fake_keys().compile('aBé')
+        self.assertEqual(plan, [(97, True), (97, False),
+                                (SHIFT, True), (98, True), (98, False), (SHIFT, False),
+                                'é'])
+        self.assertEqual(starts, [0, 2, 6, 7])
+
+    def test_tap(self):
+        self.assertEqual(fake_keys().tap('backspace', 2), [(14, True), (14, False)] * 2)
+
+    def test_hotkey(self):
+        self.assertEqual(fake_keys().hotkey('ctrl+v'), [(CTRL, True), (118, True), (118, False), (CTRL, False)])
+
+    def test_send_is_one_batch(self):
+        keys = fake_keys()
+        plan, _ = keys.compile('hello')
+        keys.send(plan)
+        self.assertEqual(keys.output.batches, [plan])
+
+    def test_send_releases_and_restores_held_keys(self):
+        keys = fake_keys()
+        keys.track(KeyboardEvent(KEY_DOWN, SHIFT))
+        keys.track(KeyboardEvent(KEY_DOWN, 97))
+        keys.send([(98, True), (98, False)])
+        self.assertEqual(keys.output.batches, [[(SHIFT, False), (97, False), (98, True), (98, False), (SHIFT, True)]])
+
+    def test_send_without_restore(self):
+        keys = fake_keys()
+        keys.track(KeyboardEvent(KEY_DOWN, CTRL))
+        keys.send([(98, True), (98, False)], restore_state=False)
+        self.assertEqual(keys.output.events, [(CTRL, False), (98, True), (98, False)])
+
+    def test_released_keys_stay_released(self):
+        keys = fake_keys()
+        keys.track(KeyboardEvent(KEY_DOWN, SHIFT))
+        keys.track(KeyboardEvent(KEY_UP, SHIFT))
+        keys.send([(98, True), (98, False)])
+        self.assertEqual(keys.output.events, [(98, True), (98, False)])
+
+    def test_replace_text(self):
+        keys = fake_keys()
+        keys.replace_text(2, 'ok')
+        self.assertEqual(keys.output.batches, [[(14, True), (14, False)] * 2 + [(111, True), (111, False), (107, True), (107, False)]])
+
+
+# Trimmed `dumpkeys` output for a layout with alt gr levels.
+DUMPKEYS_KEYS_ONLY = """keycode   2 = one              exclam           onesuperior      exclamdown
+keycode   7 = six              asciicircum      notsign          U+2014
+keycode  18 = +e               +E               U+20ac           cent
+keycode  20 = +t               +T               +thorn           +THORN
+keycode  22 = +u               +U               +u
+keycode  29 = Control
+keycode  30 = +a               +A               aacute
+keycode 100 = AltGr
+"""
+DUMPKEYS_LONG_INFO = """Symbols recognized by dumpkeys:
+(numeric value, symbol)
+
+0x0021\texclam
+0x0031\tone
+0x0036\tsix
+0x005e\tasciicircum
+0x00a1\texclamdown
+0x00a2\tcent
+0x00ac\tnotsign
+0x00b9\tonesuperior
+0x00e1\taacute
+0x00fe\tthorn
+0x00de\tTHORN
+0x0200\tnul
+0x0b61\ta
+0x0b75\tu
+"""
+
+
+class TestLayout(unittest.TestCase):
+    def test_dumpkeys_chars(self):
+        chars = dumpkeys_chars(DUMPKEYS_KEYS_ONLY, DUMPKEYS_LONG_INFO)
+        self.assertEqual(chars['!'], [(2, ('shift',))])
+        self.assertEqual(chars['¡'], [(2, ('alt gr', 'shift'))])
+        self.assertEqual(chars['—'], [(7, ('alt gr', 'shift'))])
+        self.assertEqual(chars['€'], [(18, ('alt gr',))])
+        self.assertEqual(chars['Þ'], [(20, ('alt gr', 'shift'))])
+        self.assertEqual(chars['á'], [(30, ('alt gr',))])
+        self.assertEqual(chars['a'], [(30, ())])
+        # Fewest modifiers first.
+        self.assertEqual(chars['u'], [(22, ()), (22, ('alt gr',))])
+        self.assertNotIn('Control', chars)
+
+    def test_unicode_plan(self):
+        keymap = SystemKeymap(exact=False, linux=True)
+        keymap.scan_code = FakeKeymap().scan_code
+        # ctrl+shift+u, 2, 0, 1, 4, then the modifiers released.
+        plan = keymap.unicode_plan('—')
+        self.assertEqual(plan[:3], [(CTRL, True), (SHIFT, True), (117, True)])
+        self.assertEqual([scan_code for scan_code, is_down in plan[3:-3] if is_down], [ord(digit) for digit in '2014'])
+        self.assertEqual(plan[-3:], [(CTRL, False), (SHIFT, False), (117, False)])
+        self.assertIs(keymap.unicode_plan('—'), plan)
+
+
+def events(plan):
+    return [KeyboardEvent(KEY_DOWN if is_down else KEY_UP, scan_code) for scan_code, is_down in plan]
+
+
+class TestEchoes(unittest.TestCase):
+    def test_sent_events_are_echoes(self):
+        keys = fake_keys()
+        plan, _ = keys.compile('aB')
+        keys.send(plan)
+        self.assertEqual([keys.match(event) for event in events(plan)], [Keystrokes.ECHO] * len(plan))
+        self.assertIsNone(keys.match(KeyboardEvent(KEY_DOWN, 97)))
+
+    def test_unicode_is_not_expected_back(self):
+        keys = fake_keys()
+        keys.send(['é'])
+        self.assertFalse(keys.echoes)
+
+    def test_wait_delivered(self):
+        keys = fake_keys()
+        self.assertTrue(keys.wait_delivered(0))
+        keys.send(keys.tap('a'))
+        self.assertFalse(keys.wait_delivered(0))
+        for event in events(keys.tap('a')):
+            keys.match(event)
+        self.assertTrue(keys.wait_delivered(0))
+
+    def test_replayed_keys(self):
+        keys = fake_keys()
+        held = [KeyboardEvent(KEY_DOWN, CTRL), KeyboardEvent(KEY_DOWN, 122), KeyboardEvent(KEY_UP, 122)]
+        keys.replay(held)
+        # Sent as they were, in one batch.
+        self.assertEqual(keys.output.batches, [[(CTRL, True), (122, True), (122, False)]])
+        self.assertEqual([keys.match(event) for event in held], [Keystrokes.REPLAY] * 3)
+        self.assertIsNone(keys.match(KeyboardEvent(KEY_DOWN, 122)))
+
+    def test_real_keys_between_echoes(self):
+        keys = fake_keys()
+        keys.send(keys.tap('a'))
+        echo_down, echo_up = events(keys.tap('a'))
+        self.assertEqual(keys.match(echo_down), Keystrokes.ECHO)
+        self.assertIsNone(keys.match(KeyboardEvent(KEY_DOWN, 122)))
+        self.assertEqual(keys.match(echo_up), Keystrokes.ECHO)
+
+    def test_lost_echoes_are_skipped(self):
+        keys = fake_keys()
+        keys.send(keys.tap('a') + keys.tap('b'))
+        # The events for 'a' never came back.
+        self.assertEqual([keys.match(event) for event in events(keys.tap('b'))], [Keystrokes.ECHO] * 2)
+        self.assertFalse(keys.echoes)
+
+    def test_echoes_expire(self):
+        keys = fake_keys()
+        keys.echo_timeout = -1
+        keys.send(keys.tap('a'))
+        self.assertIsNone(keys.match(events(keys.tap('a'))[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
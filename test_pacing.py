@@ -0,0 +1,24 @@
+import unittest
+
+from pacing import Calibration
+
+
+class TestCalibration(unittest.TestCase):
+    def test_fastest_intact_rate(self):
+        calibration = Calibration(rates=(None, 1000, 500), text='abc')
+        self.assertIsNone(calibration.rate)
+        self.assertFalse(calibration.passed('ac'))
+        self.assertEqual(calibration.rate, 1000)
+        self.assertTrue(calibration.passed('abc'))
+        self.assertEqual(calibration.result, 1000)
+
+    def test_falls_back_to_slowest(self):
+        calibration = Calibration(rates=(None, 1000, 500), text='abc')
+        self.assertFalse(calibration.passed(''))
+        self.assertFalse(calibration.passed('ab'))
+        self.assertTrue(calibration.passed('a'))
+        self.assertEqual(calibration.result, 500)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,407 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import keyboard
+from keyboard import KEY_DOWN, KeyboardEvent
+
+import text_expander
+import trigger_matcher
+from text_expander import TextExpander
+from trigger_store import TriggerStore
+
+
+class RecordingInjector:
+    """ Keeps the jobs it is given instead of typing them. """
+
+    def __init__(self, **kwargs):
+        self.jobs = []
+        self.forgotten = []
+        self.cancelled = 0
+        self.dropped = 0
+
+    def replace(self, delete_count, response, suffix='', skip=0):
+        self.jobs.append((delete_count, response, suffix, skip))
+
+    def forget(self, text):
+        self.forgotten.append(text)
+
+    def cancel(self):
+        self.cancelled += 1
+
+    def report_dropped(self):
+        self.dropped += 1
+
+    def is_own(self, event):
+        return getattr(event, 'injected', False)
+
+
+class FakeExpander(TextExpander):
+    """
+    TextExpander with the given triggers and settings that hooks nothing
+    and touches no files. The jobs it queues are kept in `jobs` as
+    (delete_count, response, suffix, skip). Modifiers in `held` count as pressed,
+    and `caps_led` is the caps lock LED, toggled by pressing caps lock.
+    """
+
+    def __init__(self, triggers, **settings):
+        self.test_triggers = triggers
+        self.test_settings = settings
+        self.time = 0
+        self.held = set()
+        self.caps_led = False
+        with mock.patch.object(keyboard, 'on_press'), mock.patch.object(keyboard, 'add_hotkey'), \
+                mock.patch.object(text_expander, 'Injector', RecordingInjector):
+            super().__init__()
+        self.jobs = self.injector.jobs
+
+    def load_triggers(self):
+        self.triggers = TriggerStore(self.test_triggers)
+        self.rebuild_matcher()
+
+    def load_settings(self):
+        self.settings.update(self.test_settings)
+
+    def save_triggers(self):
+        pass
+
+    def save_settings(self):
+        pass
+
+    def hook_mouse(self):
+        pass
+
+    def press(self, *names, delay=0.05, modifiers=None):
+        """ Presses keys by name, `delay` seconds apart. """
+        with mock.patch.object(keyboard, 'is_pressed', self.held.__contains__), \
+                mock.patch.object(text_expander, 'caps_lock_on', lambda: self.caps_led):
+            for name in names:
+                if name == 'caps lock':
+                    self.caps_led = not self.caps_led
+                self.time += delay
+                self.on_key_press(KeyboardEvent(KEY_DOWN, 0, name=name, time=self.time, modifiers=modifiers))
+
+
+def trigger(response, **data):
+    return dict(data, response=response)
+
+
+class TestExpansion(unittest.TestCase):
+    def test_expands(self):
+        expander = FakeExpander({'btw': trigger('by the way')})
+        expander.press('s', 'o', 'space', 'b', 't', 'w')
+        self.assertEqual(expander.jobs, [(2, 'by the way', '', 1)])
+
+    def test_word_start(self):
+        expander = FakeExpander({'hide': trigger('HIDE'), 'ing': trigger('ING', match_suffix=True)})
+        expander.press('u', 'n', 'h', 'i', 'd', 'e')
+        self.assertEqual(expander.jobs, [])
+        expander.press('space', 'r', 'i', 'n', 'g')
+        self.assertEqual(expander.jobs, [(3, 'ING', '', 0)])
+
+    def test_pattern(self):
+        expander = FakeExpander({r'd(\d+)': trigger(r'day \1', pattern=True, require_space=True)})
+        expander.press('d', '1', '2', 'space')
+        self.assertEqual(expander.jobs, [(3, 'day 12', ' ', 1)])
+
+    def test_typo(self):
+        expander = FakeExpander({'because': trigger('because', max_typos=1)})
+        expander.press(*'becase')
+        self.assertEqual(expander.jobs, [])
+        expander.press('space')
+        self.assertEqual(expander.jobs, [(3, 'because', ' ', 4)])
+
+    def test_own_keys_are_ignored(self):
+        expander = FakeExpander({'btw': trigger('by the way')})
+        expander.press('b', 't')
+        own = KeyboardEvent(KEY_DOWN, 0, name='x', time=expander.time)
+        own.injected = True
+        expander.on_key_press(own)
+        expander.press('w')
+        self.assertEqual(expander.jobs, [(2, 'by the way', '', 1)])
+
+    def test_disabled(self):
+        expander = FakeExpander({'btw': trigger('by the way', enabled=False)})
+        expander.press('b', 't', 'w')
+        self.assertEqual(expander.jobs, [])
+
+    def test_buffer_is_bounded(self):
+        expander = FakeExpander({'btw': trigger('by the way')})
+        expander.press(*'abcdefgh')
+        self.assertEqual(str(expander.buffer), 'fgh')
+
+
+class TestEdits(unittest.TestCase):
+    def setUp(self):
+        self.expander = FakeExpander({'btw': trigger('by the way')})
+
+    def test_set_trigger(self):
+        self.expander.set_trigger('idk', trigger("I don't know"))
+        self.expander.press('i', 'd', 'k')
+        self.assertEqual(self.expander.jobs, [(3, "I don't know", '', 0)])
+        self.assertEqual(self.expander.triggers.to_dict()['idk'], trigger("I don't know"))
+
+    def test_set_enabled(self):
+        self.expander.set_enabled('btw', False)
+        self.expander.press('b', 't', 'w')
+        self.assertEqual(self.expander.jobs, [])
+
+    def test_edited_responses_are_forgotten(self):
+        self.expander.set_enabled('btw', False)
+        self.assertEqual(self.expander.injector.forgotten, [])
+        self.expander.set_trigger('btw', trigger('BTW'))
+        self.expander.delete_trigger('btw')
+        self.assertEqual(self.expander.injector.forgotten, ['by the way', 'BTW'])
+
+    def test_editing_mid_word(self):
+        self.expander.press('b', 't')
+        with self.expander.editing():
+            self.expander.delete_trigger('btw')
+            self.expander.set_trigger('btw', trigger('BTW'))
+        self.expander.press('w')
+        self.assertEqual(self.expander.jobs, [(3, 'BTW', '', 0)])
+
+
+class TestLoading(unittest.TestCase):
+    def setUp(self):
+        self.expander = FakeExpander({})
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.expander.config_file = os.path.join(directory.name, 'triggers.json')
+        self.expander.compiled_file = os.path.join(directory.name, 'triggers.compiled')
+
+    def load(self, triggers):
+        with open(self.expander.config_file, 'w') as f:
+            json.dump(triggers, f)
+        TextExpander.load_triggers(self.expander)
+
+    def test_compiled_triggers_are_reused(self):
+        self.load({'btw': trigger('by the way'), 'OMW': trigger('on my way', case_sensitive=True)})
+        self.assertTrue(os.path.exists(self.expander.compiled_file))
+        with mock.patch.object(trigger_matcher.TriggerAutomaton, '__init__', side_effect=AssertionError):
+            TextExpander.load_triggers(self.expander)
+        self.expander.press('b', 't', 'w', 'space', 'O', 'M', 'W')
+        self.assertEqual(self.expander.jobs, [(2, 'by the way', '', 1), (3, 'on my way', '', 0)])
+
+    def test_edited_triggers_are_compiled_again(self):
+        self.load({'btw': trigger('by the way')})
+        self.load({'idk': trigger("I don't know")})
+        self.expander.press('b', 't', 'w', 'space', 'i', 'd', 'k')
+        self.assertEqual(self.expander.jobs, [(3, "I don't know", '', 0)])
+
+    def test_damaged_compiled_file(self):
+        self.load({'btw': trigger('by the way')})
+        with open(self.expander.compiled_file, 'r+b') as f:
+            f.truncate(40)
+        TextExpander.load_triggers(self.expander)
+        self.expander.press('b', 't', 'w')
+        self.assertEqual(self.expander.jobs, [(2, 'by the way', '', 1)])
+
+
+class TestTerminators(unittest.TestCase):
+    def test_space(self):
+        expander = FakeExpander({'omw': trigger('on my way', require_space=True)})
+        expander.press('o', 'm', 'w')
+        self.assertEqual(expander.jobs, [])
+        expander.press('space')
+        # The space already reached the application and is typed back.
+        self.assertEqual(expander.jobs, [(3, 'on my way', ' ', 1)])
+
+    def test_punctuation(self):
+        expander = FakeExpander({'omw': trigger('on my way', require_space=True)})
+        expander.press('o', 'm', 'w', '.')
+        self.assertEqual(expander.jobs, [(3, 'on my way', '.', 1)])
+
+    def test_global_setting(self):
+        expander = FakeExpander({'btw': trigger('by the way')}, require_space=True)
+        expander.press('b', 't', 'w')
+        self.assertEqual(expander.jobs, [])
+        expander.press('enter')
+        self.assertEqual(expander.jobs, [(3, 'by the way', '\n', 1)])
+
+
+class TestMinimalEdit(unittest.TestCase):
+    def test_only_the_difference_is_replaced(self):
+        expander = FakeExpander({'teh': trigger('the')})
+        expander.press('t', 'e', 'h')
+        self.assertEqual(expander.jobs, [(2, 'the', '', 1)])
+
+    def test_completion(self):
+        expander = FakeExpander({'addr': trigger('address')})
+        expander.press('a', 'd', 'd', 'r')
+        # Nothing to delete, the rest is typed after what is there.
+        self.assertEqual(expander.jobs, [(0, 'address', '', 4)])
+
+    def test_same_text(self):
+        expander = FakeExpander({'ok': trigger('ok')})
+        expander.press('o', 'k')
+        self.assertEqual(expander.jobs, [])
+
+    def test_keys_typed_since(self):
+        expander = FakeExpander({'ab': trigger('abx'), 'abcd': trigger('ABCD')}, lookahead=2)
+        expander.press('a', 'b', 'x')
+        # "abx" is on screen already; the key typed since is put back after it.
+        self.assertEqual(expander.jobs, [(0, 'abx', 'x', 3)])
+
+
+class TestLookahead(unittest.TestCase):
+    def setUp(self):
+        self.expander = FakeExpander({'ab': trigger('AB'), 'abcd': trigger('ABCD')}, lookahead=2)
+
+    def test_longer_match(self):
+        self.expander.press('a', 'b', 'c')
+        self.assertEqual(self.expander.jobs, [])
+        self.expander.press('d')
+        self.assertEqual(self.expander.jobs, [(4, 'ABCD', '', 0)])
+
+    def test_no_longer_match(self):
+        self.expander.press('a', 'b', 'x')
+        # The key typed since is put back after the response.
+        self.assertEqual(self.expander.jobs, [(3, 'AB', 'x', 0)])
+
+    def test_lookahead_runs_out(self):
+        self.expander.settings['lookahead'] = 1
+        self.expander.press('a', 'b', 'c')
+        self.assertEqual(self.expander.jobs, [(3, 'AB', 'c', 0)])
+
+    def test_terminator(self):
+        self.expander.press('a', 'b', 'space')
+        self.assertEqual(self.expander.jobs, [(3, 'AB', ' ', 0)])
+
+    def test_backspace_drops_it(self):
+        self.expander.press('a', 'b', 'c', 'backspace', 'backspace', 'x')
+        self.assertEqual(self.expander.jobs, [])
+
+    def test_off(self):
+        self.expander.settings['lookahead'] = 0
+        self.expander.press('a', 'b')
+        self.assertEqual(self.expander.jobs, [(2, 'AB', '', 0)])
+
+
+class TestLetterCase(unittest.TestCase):
+    def test_case_insensitive(self):
+        expander = FakeExpander({'btw': trigger('by the way')})
+        expander.press('B', 'T', 'w')
+        self.assertEqual(expander.jobs, [(3, 'by the way', '', 0)])
+
+    def test_case_sensitive(self):
+        expander = FakeExpander({'Omw': trigger('On my way', case_sensitive=True)})
+        expander.press('o', 'm', 'w')
+        self.assertEqual(expander.jobs, [])
+        expander.press('space', 'O', 'm', 'w')
+        self.assertEqual(expander.jobs, [(2, 'On my way', '', 1)])
+
+    def test_modifiers(self):
+        # Backends that report modifiers name keys without shift applied.
+        expander = FakeExpander({'Omw': trigger('On my way', case_sensitive=True)})
+        expander.press('o', modifiers=('shift',))
+        expander.press('m', 'w', modifiers=())
+        self.assertEqual(expander.jobs, [(2, 'On my way', '', 1)])
+
+    def test_caps_lock(self):
+        expander = FakeExpander({'OMw': trigger('On my way', case_sensitive=True)})
+        expander.press('caps lock', 'o', 'm', modifiers=())
+        expander.press('caps lock', modifiers=())
+        expander.press('w', modifiers=())
+        self.assertEqual(expander.jobs, [(2, 'On my way', '', 1)])
+
+    def test_multi_character_lowering(self):
+        # 'İ' lowers to two characters, but is one to delete.
+        expander = FakeExpander({'İst': trigger('Istanbul')})
+        expander.press('İ', 's', 't')
+        self.assertEqual(expander.jobs, [(3, 'Istanbul', '', 0)])
+
+    def test_caps_lock_on_at_start(self):
+        expander = FakeExpander({'OMW': trigger('On my way', case_sensitive=True)})
+        expander.caps_led = True
+        expander.press('o', 'm', 'w', modifiers=())
+        self.assertEqual(expander.jobs, [(2, 'On my way', '', 1)])
+
+    def test_caps_lock_read_again_after_idle(self):
+        expander = FakeExpander({'omw': trigger('on my way', case_sensitive=True)})
+        expander.press('x', modifiers=())
+        # Turned on in some other way while idle, e.g. on another keyboard.
+        expander.caps_led = True
+        expander.press('o', delay=3, modifiers=())
+        expander.press('m', 'w', modifiers=())
+        self.assertEqual(expander.jobs, [])
+        self.assertEqual(str(expander.buffer), 'OMW')
+
+
+class TestBackspace(unittest.TestCase):
+    def setUp(self):
+        self.expander = FakeExpander({'btw': trigger('by the way')})
+
+    def test_backspace(self):
+        self.expander.press('b', 't', 'x', 'backspace', 'w')
+        self.assertEqual(self.expander.jobs, [(2, 'by the way', '', 1)])
+
+    def test_backspace_past_start(self):
+        self.expander.press('b', 'backspace', 'backspace', 't', 'w')
+        self.assertEqual(self.expander.jobs, [])
+        self.expander.press('space', 'b', 't', 'w')
+        self.assertEqual(self.expander.jobs, [(2, 'by the way', '', 1)])
+
+    def test_ctrl_backspace(self):
+        expander = FakeExpander({'so.btw': trigger('so, by the way')})
+        expander.press('s', 'o', '.', 'x', 'y')
+        expander.held.add('ctrl')
+        expander.press('backspace')
+        self.assertEqual(str(expander.buffer), 'so.')
+        expander.held.clear()
+        expander.press('b', 't', 'w')
+        self.assertEqual(expander.jobs, [(4, 'so, by the way', '', 2)])
+
+    def test_ctrl_backspace_skips_punctuation(self):
+        expander = FakeExpander({'so.btw': trigger('so, by the way')})
+        expander.press('s', 'o', '.', 'x', '.', '.')
+        expander.held.add('ctrl')
+        expander.press('backspace')
+        self.assertEqual(str(expander.buffer), 'so.')
+
+
+class TestResets(unittest.TestCase):
+    def setUp(self):
+        self.expander = FakeExpander({'btw': trigger('by the way')})
+
+    def test_idle_timeout(self):
+        self.expander.press('b', 't')
+        self.expander.press('w', delay=3)
+        self.assertEqual(self.expander.jobs, [])
+        self.assertEqual(str(self.expander.buffer), 'w')
+
+    def test_no_idle_timeout(self):
+        self.expander.settings['idle_timeout'] = 0
+        self.expander.press('b', 't')
+        self.expander.press('w', delay=3)
+        self.assertEqual(self.expander.jobs, [(2, 'by the way', '', 1)])
+
+    def test_caret_keys(self):
+        for key in ('left', 'enter', 'home', 'esc'):
+            self.expander.press('b', 't', key, 'w')
+        self.assertEqual(self.expander.jobs, [])
+
+    def test_escape_cancels_expansion(self):
+        self.expander.press('b', 't', 'w', 'esc')
+        self.assertEqual(self.expander.injector.cancelled, 1)
+
+    def test_undo_reports_dropped(self):
+        self.expander.press('b', 't', 'w')
+        self.expander.held.add('ctrl')
+        self.expander.press('z')
+        self.assertEqual(self.expander.injector.dropped, 1)
+
+    def test_click(self):
+        self.expander.press('b', 't')
+        # From the mouse thread; applied on the next key.
+        self.expander.request_reset()
+        self.expander.press('w')
+        self.assertEqual(self.expander.jobs, [])
+        self.expander.press('space', 'b', 't', 'w')
+        self.assertEqual(self.expander.jobs, [(2, 'by the way', '', 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,333 @@
+import unittest
+
+from trigger_matcher import WORD_END, WORD_START, PatternAutomaton, TriggerAutomaton, TriggerIndex, TypingBuffer, TypoAutomaton, expand, pattern_error
+
+
+def automaton_of(*triggers):
+    return TriggerAutomaton([(trigger, trigger) for trigger in triggers])
+
+
+def type_text(automaton, text, state=0):
+    for char in text:
+        state = automaton.step(state, char)
+    return state
+
+
+class TestTriggerAutomaton(unittest.TestCase):
+    def test_overlapping_matches(self):
+        automaton = automaton_of('he', 'she', 'hers', 'his')
+        state = 0
+        found = []
+        for char in 'ushers':
+            state = automaton.step(state, char)
+            found.append(automaton.matches(state))
+        self.assertEqual(found, [(), (), (), ('he', 'she'), (), ('hers',)])
+
+    def test_matches_keep_trigger_order(self):
+        automaton = automaton_of('he', 'she')
+        self.assertEqual(automaton.matches(type_text(automaton, 'she')), ('he', 'she'))
+
+    def test_mismatch_falls_back(self):
+        automaton = automaton_of('abc', 'bcd')
+        self.assertEqual(automaton.matches(type_text(automaton, 'abcd')), ('bcd',))
+        self.assertEqual(automaton.matches(type_text(automaton, 'abx')), ())
+
+    def test_duplicates_and_empty_triggers(self):
+        automaton = automaton_of('btw', 'btw', '')
+        self.assertEqual(automaton.matches(type_text(automaton, 'btw')), ('btw',))
+        self.assertEqual(automaton.matches(0), ())
+
+    def test_serialization(self):
+        automaton = automaton_of('he', 'she', 'hers', 'his')
+        loaded = TriggerAutomaton.from_bytes(automaton.to_bytes())
+        for text in ('ushers', 'this', 'he'):
+            self.assertEqual(loaded.matches(type_text(loaded, text)), automaton.matches(type_text(automaton, text)))
+        self.assertEqual(loaded.can_extend(type_text(loaded, 'her')), True)
+        with self.assertRaises(ValueError):
+            TriggerAutomaton.from_bytes(b'not an automaton')
+
+    def test_can_extend(self):
+        automaton = automaton_of('ab', 'abcd')
+        state = type_text(automaton, 'ab')
+        self.assertTrue(automaton.can_extend(state))
+        state = type_text(automaton, 'cd', state)
+        self.assertFalse(automaton.can_extend(state))
+
+    def test_shared_pattern(self):
+        automaton = TriggerAutomaton([('btw', 'btw'), ('btw', 'BTW')])
+        self.assertEqual(automaton.matches(type_text(automaton, 'btw')), ('btw', 'BTW'))
+
+
+def trigger(**data):
+    return dict(data, response='response')
+
+
+def type_into(index, text, state=None):
+    state = index.start() if state is None else state
+    for char in text:
+        state = index.step(state, char)
+    return state
+
+
+def matched(index, text, state=None):
+    return [trigger for trigger, data in index.matches(type_into(index, text, state))]
+
+
+def terminated(index, text):
+    return [trigger for trigger, data in index.terminated_matches(type_into(index, text))]
+
+
+class TestTriggerIndex(unittest.TestCase):
+    def test_disabled_triggers_dont_match(self):
+        index = TriggerIndex({'btw': trigger(), 'omw': trigger(enabled=False)})
+        self.assertEqual(matched(index, 'btw'), ['btw'])
+        self.assertEqual(matched(index, 'omw'), [])
+
+    def test_word_start(self):
+        index = TriggerIndex({'btw': trigger(), 'ab': trigger(match_suffix=True)})
+        self.assertEqual(matched(index, 'btw'), ['btw'])
+        self.assertEqual(matched(index, 'a btw'), ['btw'])
+        self.assertEqual(matched(index, 'xbtw'), [])
+        self.assertEqual(matched(index, 'xab'), ['ab'])
+
+    def test_terminators(self):
+        index = TriggerIndex({'omw': trigger(require_space=True), 'btw': trigger()})
+        self.assertEqual(matched(index, 'omw'), [])
+        self.assertEqual(terminated(index, 'omw'), ['omw'])
+        self.assertEqual(matched(index, 'btw'), ['btw'])
+        index = TriggerIndex({'btw': trigger()}, require_space=True)
+        self.assertEqual(matched(index, 'btw'), [])
+        self.assertEqual(terminated(index, 'btw'), ['btw'])
+
+    def test_case(self):
+        index = TriggerIndex({'btw': trigger(), 'Omw': trigger(case_sensitive=True)})
+        self.assertEqual(matched(index, 'BtW'), ['btw'])
+        self.assertEqual(matched(index, 'Omw'), ['Omw'])
+        self.assertEqual(matched(index, 'omw'), [])
+
+    def test_multi_character_lowering(self):
+        # 'İ' lowers to 'i' and a combining dot.
+        index = TriggerIndex({'İst': trigger(), 'İstanbul': trigger(max_typos=1)})
+        self.assertEqual(matched(index, 'İST'), ['İst'])
+        self.assertEqual(matched(index, 'ist'), [])
+        self.assertEqual(terminated(index, 'İstanbl'), ['İstanbul'])
+        self.assertEqual(expand('İstanbul', trigger(max_typos=1), 'go İstanbl'), (7, 'response'))
+
+    def test_final_sigma(self):
+        # Typed one at a time, 'Σ' always lowers to 'σ'.
+        index = TriggerIndex({'ΟΔΟΣ': trigger(), 'ΚΟΣΜΟΣ': trigger(max_typos=1)})
+        self.assertEqual(matched(index, 'οδοσ'), ['ΟΔΟΣ'])
+        self.assertEqual(terminated(index, 'ΚΟΜΟΣ'), ['ΚΟΣΜΟΣ'])
+
+    def test_case_edit(self):
+        index = TriggerIndex({'Omw': trigger()})
+        edited = index.edited({'Omw': trigger(case_sensitive=True)})
+        self.assertEqual(matched(index, 'omw'), ['Omw'])
+        self.assertEqual(matched(edited, 'omw'), [])
+        self.assertEqual(matched(edited, 'Omw'), ['Omw'])
+
+    def test_longest_first(self):
+        index = TriggerIndex({'ab': trigger(match_suffix=True), 'cab': trigger()})
+        self.assertEqual(matched(index, 'cab'), ['cab', 'ab'])
+
+    def test_priority(self):
+        index = TriggerIndex({'btw': trigger(), 'BTW': trigger(case_sensitive=True, priority=5)})
+        self.assertEqual(matched(index, 'BTW'), ['BTW', 'btw'])
+
+    def test_lookahead(self):
+        index = TriggerIndex({'btw': trigger(), 'omw': trigger(require_space=True)})
+        self.assertTrue(index.can_extend(type_into(index, 'bt')))
+        self.assertFalse(index.can_extend(type_into(index, 'btw')))
+        # Still waiting for the terminator.
+        self.assertTrue(index.can_extend(type_into(index, 'omw')))
+
+    def test_patterns(self):
+        index = TriggerIndex({r'd(\d+)': trigger(pattern=True)})
+        self.assertEqual(matched(index, 'd12'), [r'd(\d+)'])
+        self.assertEqual(matched(index, 'xd12'), [])
+
+    def test_typos(self):
+        index = TriggerIndex({'because': trigger(max_typos=1)})
+        # Only once the word is finished.
+        self.assertEqual(matched(index, 'becase'), [])
+        self.assertEqual(terminated(index, 'becase'), ['because'])
+        self.assertEqual(terminated(index, 'becuase'), [])
+        self.assertEqual(terminated(index, 'bcase'), [])
+
+    def test_typos_per_length(self):
+        # At most one typo per three characters.
+        index = TriggerIndex({'ab': trigger(max_typos=2), 'abcdef': trigger(max_typos=2)})
+        self.assertEqual(terminated(index, 'ax'), [])
+        self.assertEqual(terminated(index, 'abcxyf'), ['abcdef'])
+
+    def test_edits(self):
+        index = TriggerIndex({'btw': trigger(), 'omw': trigger()})
+        edited = index.edited({'idk': trigger(), 'omw': None})
+        self.assertEqual(matched(edited, 'idk'), ['idk'])
+        self.assertEqual(matched(edited, 'omw'), [])
+        self.assertEqual(matched(edited.edited({'btw': trigger(enabled=False)}), 'btw'), [])
+        self.assertIs(edited.base, index.base)
+        # The original is left as it was.
+        self.assertEqual(matched(index, 'omw'), ['omw'])
+        self.assertEqual(matched(index, 'idk'), [])
+
+    def test_records(self):
+        index = TriggerIndex({'btw': trigger(), 'omw': trigger()}).edited({'idk': trigger(), 'omw': None})
+        self.assertEqual([trigger for trigger, data in index.records()], ['btw', 'idk'])
+        self.assertIsNone(index.get('omw'))
+        self.assertEqual(index.get('idk'), trigger())
+
+    def test_compaction(self):
+        index = TriggerIndex({'btw': trigger()})
+        index.min_compact_size = 2
+        edited = index.edited({'aa': trigger(), 'bb': trigger(), 'cc': trigger()})
+        self.assertIsNot(edited.base, index.base)
+        self.assertEqual(edited.overrides, {})
+        self.assertEqual(matched(edited, 'bb'), ['bb'])
+
+    def test_translate(self):
+        index = TriggerIndex({'btw': trigger()})
+        edited = index.edited({'idk': trigger()})
+        state = edited.translate(index, type_into(index, 'bt'))
+        self.assertEqual(matched(edited, 'w', state), ['btw'])
+        compacted = TriggerIndex(dict(edited.records()))
+        self.assertEqual(compacted.translate(edited, state), compacted.start())
+
+
+class TestTypingBuffer(unittest.TestCase):
+    def test_keeps_the_last_characters(self):
+        buffer = TypingBuffer(3)
+        for char in 'hello':
+            buffer.append(char)
+        self.assertEqual((str(buffer), len(buffer)), ('llo', 3))
+        self.assertEqual(buffer.tail(2), 'lo')
+        self.assertEqual(buffer.tail(10), 'llo')
+
+    def test_clear(self):
+        buffer = TypingBuffer(3)
+        buffer.append('a')
+        buffer.clear()
+        self.assertEqual(str(buffer), '')
+
+    def test_resize(self):
+        buffer = TypingBuffer(4)
+        for char in 'abcdef':
+            buffer.append(char)
+        buffer.resize(2)
+        self.assertEqual(str(buffer), 'ef')
+        buffer.resize(3)
+        buffer.append('g')
+        self.assertEqual(str(buffer), 'efg')
+
+    def test_backspace_restores_state(self):
+        index = TriggerIndex({'btw': trigger()})
+        buffer = TypingBuffer(8)
+        state = index.start()
+        for char in 'btx':
+            state = index.step(state, char)
+            buffer.append(char, state)
+        state = buffer.pop()
+        self.assertEqual(str(buffer), 'bt')
+        self.assertEqual(matched(index, 'w', state), ['btw'])
+
+    def test_pop_past_start(self):
+        buffer = TypingBuffer(2)
+        for char in 'abc':
+            buffer.append(char, char)
+        self.assertEqual(str(buffer), 'bc')
+        self.assertEqual(buffer.pop(), 'b')
+        self.assertIsNone(buffer.pop())
+        self.assertIsNone(buffer.pop())
+
+
+class TestExpand(unittest.TestCase):
+    def test_literal(self):
+        self.assertEqual(expand('btw', {'response': 'by the way'}, 'so btw'), (3, 'by the way'))
+
+    def test_pattern_groups(self):
+        data = {'response': r'day \1 of \g<total>', 'pattern': True}
+        self.assertEqual(expand(r'd(\d+)/(?P<total>\d+)', data, 'on d3/10'), (5, 'day 3 of 10'))
+
+    def test_typo(self):
+        self.assertEqual(expand('because', {'response': 'because', 'max_typos': 1}, 'so becase'), (6, 'because'))
+
+
+def pattern_automaton(*patterns):
+    return PatternAutomaton([(pattern, {'pattern': True}) for pattern in patterns])
+
+
+def type_pattern(automaton, text, state=0):
+    state = automaton.step(state, WORD_START)
+    for char in text:
+        state = automaton.step(state, char)
+    return state
+
+
+class TestPatternAutomaton(unittest.TestCase):
+    def test_matches(self):
+        automaton = pattern_automaton('d[0-9]+', 'x.y')
+        self.assertEqual(automaton.matches(type_pattern(automaton, 'd12')), ('d[0-9]+',))
+        self.assertEqual(automaton.matches(type_pattern(automaton, 'xay')), ('x.y',))
+        self.assertEqual(automaton.matches(type_pattern(automaton, 'd')), ())
+
+    def test_invalid_patterns(self):
+        self.assertIsNone(pattern_error('d[0-9]+', {'pattern': True}))
+        for pattern in ('d[', '^d', 'x*', r'(a)\1'):
+            self.assertIsNotNone(pattern_error(pattern, {'pattern': True}), pattern)
+
+    def test_cache_is_bounded(self):
+        automaton = pattern_automaton('d[0-9]+')
+        automaton.max_states = 4
+        automaton.max_transitions = 8
+        state = type_pattern(automaton, 'd')
+        for char in '0123456789' * 10 + 'abc' * 10 + WORD_START + 'd1':
+            state = automaton.step(state, char)
+            self.assertLessEqual(len(automaton), automaton.max_states + 1)
+            self.assertLessEqual(automaton.transitions, automaton.max_transitions)
+        # Matching carries on across flushes.
+        self.assertGreater(automaton.first, 0)
+        self.assertEqual(automaton.matches(state), ('d[0-9]+',))
+
+    def test_stale_states_are_the_root(self):
+        automaton = pattern_automaton('d[0-9]+')
+        stale = type_pattern(automaton, 'd1')
+        automaton._flush()
+        self.assertEqual(automaton.matches(stale), ())
+        self.assertEqual(automaton.matches(automaton.step(stale, '1')), ())
+        self.assertEqual(automaton.matches(type_pattern(automaton, 'd1', stale)), ('d[0-9]+',))
+
+
+
+def typo_automaton(*triggers):
+    return TypoAutomaton([(trigger, {'max_typos': 1}) for trigger in triggers])
+
+
+class TestTypoAutomaton(unittest.TestCase):
+    def test_matches(self):
+        automaton = typo_automaton('because')
+        self.assertEqual(automaton.matches(type_pattern(automaton, 'becase' + WORD_END)), ('because',))
+        self.assertEqual(automaton.matches(type_pattern(automaton, 'becase')), ())
+        self.assertEqual(automaton.matches(type_pattern(automaton, 'bcase' + WORD_END)), ())
+
+    def test_cache_is_bounded(self):
+        automaton = typo_automaton('because', 'between')
+        automaton.max_states = 4
+        automaton.max_transitions = 8
+        state = 0
+        for char in (WORD_START + 'abcdefgh') * 10 + WORD_START + 'becase' + WORD_END:
+            state = automaton.step(state, char)
+            self.assertLessEqual(len(automaton), automaton.max_states + 1)
+            self.assertLessEqual(automaton.transitions, automaton.max_transitions)
+        # Matching carries on across flushes.
+        self.assertGreater(automaton.first, 0)
+        self.assertEqual(automaton.matches(state), ('because',))
+
+    def test_stale_states_are_the_root(self):
+        automaton = typo_automaton('because')
+        stale = type_pattern(automaton, 'becase')
+        automaton._flush()
+        self.assertEqual(automaton.matches(automaton.step(stale, WORD_END)), ())
+        self.assertEqual(automaton.matches(type_pattern(automaton, 'becase' + WORD_END, stale)), ('because',))
+
+if __name__ == '__main__':
+    unittest.main()
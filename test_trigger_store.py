@@ -0,0 +1,73 @@
+import unittest
+
+from trigger_store import RecordSnapshot, TriggerStore
+
+TRIGGERS = {
+    'btw': {'response': 'by the way', 'enabled': True, 'tags': ['chat', 'short']},
+    'omw': {'response': 'on my way \U0001f697', 'require_space': True, 'max_typos': 1, 'priority': -3},
+    r'd(\d+)': {'response': r'day \1', 'pattern': True, 'case_sensitive': False, 'match_suffix': True},
+    # Values the columns can't hold are kept as they are.
+    'odd': {'response': 'odd', 'enabled': 1, 'max_typos': 7, 'tags': 'one', 'note': {'any': 'thing'}},
+    'empty': {},
+}
+
+
+class TestTriggerStore(unittest.TestCase):
+    def test_round_trip(self):
+        store = TriggerStore(TRIGGERS)
+        self.assertEqual(store.to_dict(), TRIGGERS)
+
+    def test_round_trip_after_compact(self):
+        store = TriggerStore(TRIGGERS)
+        store['btw'] = dict(store['btw'], enabled=False)
+        del store['empty']
+        store.compact()
+        expected = dict(TRIGGERS, btw=dict(TRIGGERS['btw'], enabled=False))
+        del expected['empty']
+        self.assertEqual(store.to_dict(), expected)
+
+    def test_records_keep_their_data(self):
+        store = TriggerStore(TRIGGERS)
+        record = store['btw']
+        store['btw'] = {'response': 'changed'}
+        store.compact()
+        self.assertEqual(record['response'], 'by the way')
+        self.assertEqual(store['btw']['response'], 'changed')
+
+
+class TestRecordSnapshot(unittest.TestCase):
+    def test_store_records_are_slots(self):
+        store = TriggerStore(TRIGGERS)
+        snapshot = RecordSnapshot(store.items())
+        self.assertIs(snapshot.columns, store.columns)
+        self.assertEqual(len(snapshot.own_columns), 0)
+        self.assertEqual(dict(snapshot.items()), TRIGGERS)
+        self.assertEqual([trigger for trigger, data in snapshot.items()], list(TRIGGERS))
+
+    def test_other_records_are_copied(self):
+        store = TriggerStore(TRIGGERS)
+        snapshot = RecordSnapshot([('btw', store['btw']), ('new', {'response': 'new'}),
+                                   ('omw', TriggerStore(TRIGGERS)['omw'])])
+        self.assertEqual(len(snapshot.own_columns), 2)
+        self.assertEqual(dict(snapshot.items()), {'btw': TRIGGERS['btw'], 'new': {'response': 'new'},
+                                                  'omw': TRIGGERS['omw']})
+
+    def test_lookup(self):
+        snapshot = RecordSnapshot(TriggerStore(TRIGGERS).items())
+        for trigger, data in TRIGGERS.items():
+            self.assertIn(trigger, snapshot)
+            self.assertEqual(snapshot.get(trigger), data)
+        self.assertNotIn('missing', snapshot)
+        self.assertIsNone(snapshot.get('missing'))
+        self.assertEqual(RecordSnapshot().find('btw'), -1)
+
+    def test_keeps_its_data(self):
+        store = TriggerStore(TRIGGERS)
+        snapshot = RecordSnapshot(store.items())
+        store['btw'] = {'response': 'changed'}
+        store.compact()
+        self.assertEqual(snapshot.get('btw')['response'], 'by the way')
+
+
+if __name__ == '__main__':
+    unittest.main()
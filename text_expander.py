@@ -1,45 +1,248 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
+import hashlib
 import json
 import keyboard
 import os
+import threading
+from contextlib import contextmanager
 from typing import Dict, Any
-from win32gui import ShowWindow
-from win32con import SW_RESTORE, SW_MINIMIZE
+from clipboard import system_clipboard
+from injector import Injector
+from keystrokes import caps_lock_on
+from pacing import Calibration, PacingTable
+from trigger_store import TriggerStore
+from trigger_matcher import MAX_TYPOS, TriggerIndex, TypingBuffer, expand, is_boundary, pattern_error
+
+# Keys that move the caret or leave the current line; whatever was typed
+# before them is no longer next to the caret.
+RESET_KEYS = {'enter', 'tab', 'esc', 'up', 'down', 'left', 'right',
+              'home', 'end', 'page up', 'page down'}
+
+# Keys that end a word, with the text they type. Punctuation ends words too.
+TERMINATOR_KEYS = {'space': ' ', 'enter': '\n', 'tab': '\t'}
 
 class TextExpander:
     def __init__(self):
-        self.triggers = {}
-        self.buffer = ""
+        # Kept compact; records read back as read-only dict-like views.
+        self.triggers = TriggerStore()
+        # Last typed characters, sized to the longest trigger.
+        self.buffer = TypingBuffer()
+        self.last_key_time = 0
+        self.reset_requested = False
+        # Read from the keyboard when None, see sync_caps_lock.
+        self.caps_lock = None
+        # (typed_length, response, typed_since) of an expansion held back
+        # while a longer trigger may still match.
+        self.deferred = None
+        # The matcher is only replaced, never modified, so the keyboard
+        # thread can read it without locks while the UI edits triggers.
+        self.matcher = TriggerIndex()
+        # Typing state, owned by the keyboard thread, and the matcher it
+        # belongs to.
+        self.state = None
+        self.state_matcher = None
+        # Called as callback(trigger, old_data, new_data) for every edit,
+        # with None standing for a missing trigger.
+        self.listeners = [self.update_matcher, self.forget_plan]
+        self.pending_changes = None
         self.config_file = "triggers.json"
+        # The compiled base automata of config_file, see load_matcher.
+        self.compiled_file = "triggers.compiled"
         self.settings = {
-            'require_space': False  # Default setting for space trigger
+            'require_space': False,  # Default setting for space trigger
+            'idle_timeout': 2,  # Seconds without typing before the buffer is discarded
+            'reset_on_click': True,  # Discard the buffer when the mouse is clicked
+            'lookahead': 0,  # Keys to wait for a longer trigger before expanding a shorter one
+            'capture_typeahead': True,  # Hold keys typed during an expansion and replay them after it
+            'adaptive_pacing': True,  # Type into each application as fast as it keeps up with
+            'paste_long_responses': True  # Paste responses that would take longer to type
         }
-        self.load_triggers()
         self.load_settings()
+        # Typing rates per application, see PacingTable.
+        self.pacing = PacingTable() if self.settings['adaptive_pacing'] else None
+        # Types expansions off the keyboard thread.
+        self.injector = Injector(capture_typeahead=self.settings['capture_typeahead'], pacing=self.pacing,
+                                 clipboard=system_clipboard() if self.settings['paste_long_responses'] else None)
+        self.load_triggers()
         keyboard.on_press(self.on_key_press)
+        if self.settings['reset_on_click']:
+            self.hook_mouse()
         # Register global hotkey for showing/hiding window
         keyboard.add_hotkey('alt+s', self.toggle_window)
         self.ui = None  # Will be set by SettingsUI
 
     def load_triggers(self):
+        data = None
         try:
             if os.path.exists(self.config_file):
-                with open(self.config_file, 'r') as f:
-                    self.triggers = json.load(f)
+                with open(self.config_file, 'rb') as f:
+                    data = f.read()
+                self.triggers = TriggerStore(json.loads(data))
         except Exception as e:
             print(f"Error loading triggers: {e}")
-            self.triggers = {}
+            self.triggers = TriggerStore()
+            data = None
+        if data is None:
+            self.rebuild_matcher()
+        else:
+            self.load_matcher(data)
+
+    def load_matcher(self, data):
+        # Compiling a large trigger set is slow, so the compiled automata are
+        # kept in compiled_file behind a hash of the triggers.json contents
+        # (`data`) and settings they were compiled from, and reused while
+        # that hash still matches.
+        require_space = self.settings['require_space']
+        digest = hashlib.sha256(json.dumps(require_space).encode() + b'\n' + data).digest()
+        try:
+            with open(self.compiled_file, 'rb') as f:
+                compiled = f.read()
+            if compiled.startswith(digest):
+                self.matcher = TriggerIndex(self.triggers, require_space, compiled[len(digest):])
+                return
+        except Exception:
+            pass  # Missing, stale or damaged: compile again.
+        self.rebuild_matcher()
+        try:
+            with open(self.compiled_file, 'wb') as f:
+                f.write(digest + self.matcher.save_literals())
+        except OSError as e:
+            print(f"Error saving compiled triggers: {e}")
 
     def save_triggers(self):
         with open(self.config_file, 'w') as f:
-            json.dump(self.triggers, f, indent=2)
+            json.dump(self.triggers.to_dict(), f, indent=2)
+
+    def rebuild_matcher(self):
+        self.matcher = TriggerIndex(self.triggers, self.settings['require_space'])
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def notify(self, trigger, old, new):
+        for callback in self.listeners:
+            callback(trigger, old, new)
+
+    def forget_plan(self, trigger, old, new):
+        # The injector keeps key events compiled per response; drop the ones
+        # for a response that was edited away.
+        if old is not None and (new is None or new.get('response') != old.get('response')):
+            self.injector.forget(old.get('response'))
+
+    def set_trigger(self, trigger, data):
+        old = self.triggers.get(trigger)
+        self.triggers[trigger] = data
+        self.notify(trigger, old, self.triggers[trigger])
+
+    def set_enabled(self, trigger, enabled):
+        old = self.triggers.get(trigger)
+        if old is not None and old.get('enabled', True) != enabled:
+            self.set_trigger(trigger, dict(old, enabled=enabled))
+
+    def delete_trigger(self, trigger):
+        old = self.triggers.pop(trigger, None)
+        if old is not None:
+            self.notify(trigger, old, None)
+
+    @contextmanager
+    def editing(self):
+        # Collects the edits made inside the block and publishes them to
+        # the matcher as a single new snapshot.
+        if self.pending_changes is not None:
+            yield
+            return
+        self.pending_changes = {}
+        try:
+            yield
+        finally:
+            changes, self.pending_changes = self.pending_changes, None
+            if changes:
+                self.matcher = self.matcher.edited(changes)
+
+    def update_matcher(self, trigger, old, new):
+        if self.pending_changes is not None:
+            self.pending_changes[trigger] = new
+        else:
+            self.matcher = self.matcher.edited({trigger: new})
+
+    def sync_state(self):
+        # Reads the published matcher once per key. If the UI swapped in a
+        # new one since the last key, carry the typing state over to it.
+        matcher = self.matcher
+        previous = self.state_matcher
+        if matcher is not previous:
+            self.state = matcher.translate(previous, self.state)
+            self.buffer.map_states(lambda state: matcher.translate(previous, state))
+            self.state_matcher = matcher
+            capacity = max(matcher.max_length, 1)
+            if self.buffer.capacity != capacity:
+                self.buffer.resize(capacity)
+        return matcher
+
+    def hook_mouse(self):
+        try:
+            from keyboard import mouse
+        except (ImportError, OSError) as e:
+            print(f"Mouse clicks won't reset typing: {e}")
+            return
+        mouse.on_click(self.request_reset)
+
+    def request_reset(self):
+        # Called from the mouse thread; the keyboard thread does the reset
+        # on its next key so typing state keeps a single writer.
+        self.reset_requested = True
+
+    def reset_typing(self, matcher):
+        self.buffer.clear()
+        self.state = matcher.start()
+        self.deferred = None
+
+    def typed_char(self, event):
+        # Windows names keys after the shift and caps lock state already.
+        # Elsewhere the event lists the held modifiers, so apply them here
+        # (caps lock is tracked from its own key presses, see
+        # sync_caps_lock).
+        char = event.name
+        if event.modifiers is None or not char.isalpha():
+            return char
+        upper = any(modifier.endswith('shift') for modifier in event.modifiers) != self.caps_lock
+        return char.upper() if upper else char.lower()
+
+    def sync_caps_lock(self, name):
+        # Caps lock may be on before the first key we see, and presses can be
+        # missed, so its state is read from the keyboard's LED at the first
+        # key and after every idle reset, then toggled with the key. The LED
+        # may lag behind a caps lock press, so that key is never the one it
+        # is read at.
+        if name == 'caps lock':
+            if self.caps_lock is not None:
+                self.caps_lock = not self.caps_lock
+        elif self.caps_lock is None:
+            self.caps_lock = bool(caps_lock_on())
+
+    def type_char(self, matcher, char):
+        self.state = matcher.step(self.state, char)
+        self.buffer.append(char, self.state)
+
+    def erase_typed(self, matcher, whole_word=False):
+        # Go back to the matcher state the previous character left behind
+        # instead of rescanning what's left. ctrl+backspace erases up to the
+        # start of the word, like most editors.
+        self.deferred = None
+        state = self.buffer.pop()
+        if whole_word:
+            while self.buffer and not self.buffer.last().isalnum():
+                state = self.buffer.pop()
+            while self.buffer and self.buffer.last().isalnum():
+                state = self.buffer.pop()
+        self.state = matcher.start() if state is None else state
 
     def load_settings(self):
         try:
             if os.path.exists('settings.json'):
                 with open('settings.json', 'r') as f:
-                    self.settings = json.load(f)
+                    self.settings.update(json.load(f))
         except:
             self.save_settings()
 
@@ -48,39 +251,100 @@ class TextExpander:
             json.dump(self.settings, f, indent=2)
 
     def on_key_press(self, event):
-        if self.settings['require_space']:
-            # Space-triggered behavior
-            if event.name == 'space':
-                self.check_for_trigger()
-                self.buffer = ""
-            elif len(event.name) == 1:
-                self.buffer += event.name
+        if self.injector.is_own(event):
+            # Our own expansion, typed back at us.
+            return
+        matcher = self.sync_state()
+        timeout = self.settings['idle_timeout']
+        if self.reset_requested or (timeout and event.time - self.last_key_time > timeout):
+            self.reset_requested = False
+            self.reset_typing(matcher)
+            self.caps_lock = None
+        self.last_key_time = event.time
+        self.sync_caps_lock(event.name)
+
+        # Whether a trigger must start a word or wait for a terminator (the
+        # global require_space setting included) is compiled into the
+        # matcher, so every key takes the same path.
+        name = event.name
+        if name == 'backspace':
+            self.erase_typed(matcher, whole_word=keyboard.is_pressed('ctrl'))
+        elif name in TERMINATOR_KEYS:
+            self.check_for_trigger(matcher, TERMINATOR_KEYS[name])
+            self.reset_typing(matcher)
+        elif name in RESET_KEYS:
+            if name == 'esc':
+                # Stops a long expansion that is still being typed.
+                self.injector.cancel()
+            self.reset_typing(matcher)
+        elif len(name) == 1:
+            if name == 'z' and self.pacing and keyboard.is_pressed('ctrl'):
+                # Undoing right after an expansion usually means it came out
+                # garbled; slow down for that application.
+                self.injector.report_dropped()
+            char = self.typed_char(event)
+            if is_boundary(char) and self.check_for_trigger(matcher, char):
+                return
+            self.type_char(matcher, char)
+            self.check_for_trigger(matcher)
+
+    def check_for_trigger(self, matcher, terminator=None):
+        # The matcher already knows which triggers the typed text ends with,
+        # best first, so only those candidates are looked at. When a
+        # terminator key was pressed, the candidates are the triggers
+        # waiting for one instead.
+        if terminator is None:
+            candidates = matcher.matches(self.state)
         else:
-            # Immediate replacement behavior
-            if len(event.name) == 1:
-                self.buffer += event.name
-                self.check_for_trigger()
-            elif event.name == 'space':
-                self.buffer = ""
-
-    def check_for_trigger(self):
-        for trigger, data in self.triggers.items():
-            if not data.get('enabled', True):
+            candidates = matcher.terminated_matches(self.state)
+        for trigger, data in candidates:
+            expansion = expand(trigger, data, str(self.buffer))
+            if expansion is None:
                 continue
-            
-            if self.buffer.endswith(trigger):
-                # Check if this specific trigger requires space
-                if data.get('require_space', False) and not self.last_key == 'space':
-                    continue
-                
-                # Delete trigger characters
-                for _ in range(len(trigger)):
-                    keyboard.press_and_release('backspace')
-                
-                # Type the response
-                keyboard.write(data['response'])
-                self.buffer = ""
-                break
+            if terminator is None and self.settings['lookahead'] and matcher.can_extend(self.state):
+                # A longer trigger may still match, hold this one back
+                self.deferred = expansion + ('',)
+                return False
+            typed_length, response = expansion
+            self.replace_typed(matcher, typed_length, response, terminator=terminator or '')
+            return True
+        return self.expand_deferred(matcher, terminator)
+
+    def expand_deferred(self, matcher, terminator=None):
+        # Nothing matched the key just typed. A held-back expansion fires on
+        # a terminator, once no longer trigger can match, or when the
+        # lookahead runs out; the keys typed since then are typed again
+        # after the response.
+        if self.deferred is None:
+            return False
+        typed_length, response, typed_since = self.deferred
+        if terminator is None:
+            typed_since += self.buffer.last()
+            if matcher.can_extend(self.state) and len(typed_since) < self.settings['lookahead']:
+                self.deferred = (typed_length, response, typed_since)
+                return False
+            terminator = ''
+        self.replace_typed(matcher, typed_length, response, typed_since, terminator)
+        return True
+
+    def replace_typed(self, matcher, typed_length, response, typed_since='', terminator=''):
+        # Delete trigger characters, and what was typed after them that
+        # already reached the application, then type the response putting
+        # the rest back after it. Only queued here; the injector types it
+        # while key events keep being handled.
+        typed = self.buffer.tail(typed_length + len(typed_since)) + terminator
+        suffix = typed_since + terminator
+        delete_count = typed_length + len(suffix)
+        kept = 0
+        if len(typed) == delete_count:
+            # Leave alone what the output starts with anyway, e.g. "addr"
+            # expanding to "address" or a typo fixed near its end, and only
+            # replace the rest.
+            kept = len(os.path.commonprefix([typed, response + suffix]))
+            delete_count -= kept
+        if delete_count or kept < len(response + suffix):
+            self.injector.replace(delete_count, response, suffix, kept)
+        self.reset_typing(matcher)
 
     def toggle_window(self):
         if self.ui:
@@ -94,6 +358,7 @@ class SettingsUI:
         self.root.geometry("800x600")
         self.setup_ui()
         self.expander.ui = self  # Set UI reference in expander
+        self.expander.add_listener(self.on_trigger_changed)
         self.window_visible = True
 
     def setup_ui(self):
@@ -180,6 +445,10 @@ class SettingsUI:
         )
         space_trigger_cb.pack(side='left')
 
+        tk.Button(settings_frame, text="Calibrate Typing Speed",
+                 command=self.calibrate_pacing,
+                 bg='#1e88e5', fg='white', bd=0).pack(side='left', padx=5)
+
         self.refresh_triggers()
 
     def add_trigger(self):
@@ -333,6 +602,64 @@ class SettingsUI:
                                              activeforeground='white')
         spacebar_trigger_cb.pack(side='left', padx=5)
 
+        # Match inside words option
+        match_suffix_var = tk.BooleanVar(value=False)
+        match_suffix_cb = tk.Checkbutton(options_frame,
+                                         text="Match Inside Words",
+                                         variable=match_suffix_var,
+                                         bg='#1e1e1e',
+                                         fg='white',
+                                         selectcolor='#2b2b2b',
+                                         activebackground='#1e1e1e',
+                                         activeforeground='white')
+        match_suffix_cb.pack(side='left', padx=5)
+
+        # Pattern trigger option
+        pattern_var = tk.BooleanVar(value=False)
+        pattern_cb = tk.Checkbutton(options_frame,
+                                    text="Pattern (Regex)",
+                                    variable=pattern_var,
+                                    bg='#1e1e1e',
+                                    fg='white',
+                                    selectcolor='#2b2b2b',
+                                    activebackground='#1e1e1e',
+                                    activeforeground='white')
+        pattern_cb.pack(side='left', padx=5)
+
+        # Typo tolerance option
+        tk.Label(options_frame,
+                text="Typos Allowed:",
+                bg='#1e1e1e',
+                fg='white').pack(side='left', padx=(10, 5))
+        max_typos_var = tk.IntVar(value=0)
+        max_typos_spinbox = tk.Spinbox(options_frame,
+                                       from_=0,
+                                       to=MAX_TYPOS,
+                                       textvariable=max_typos_var,
+                                       width=3,
+                                       state='readonly',
+                                       readonlybackground='#2b2b2b',
+                                       buttonbackground='#2b2b2b',
+                                       fg='white')
+        max_typos_spinbox.pack(side='left', padx=5)
+
+        # Priority option, for triggers that overlap
+        tk.Label(options_frame,
+                text="Priority:",
+                bg='#1e1e1e',
+                fg='white').pack(side='left', padx=(10, 5))
+        priority_var = tk.IntVar(value=0)
+        priority_spinbox = tk.Spinbox(options_frame,
+                                      from_=-9,
+                                      to=9,
+                                      textvariable=priority_var,
+                                      width=3,
+                                      state='readonly',
+                                      readonlybackground='#2b2b2b',
+                                      buttonbackground='#2b2b2b',
+                                      fg='white')
+        priority_spinbox.pack(side='left', padx=5)
+
         # Preview section
         preview_frame = tk.LabelFrame(main_frame,
                                     text="Preview",
@@ -368,15 +695,23 @@ class SettingsUI:
         def save():
             trigger = trigger_entry.get().strip()
             if trigger:
-                self.expander.triggers[trigger] = {
+                data = {
                     'enabled': True,
                     'response': response_text.get("1.0", tk.END).strip(),
                     'tags': [t.strip() for t in tags_entry.get().split(',') if t.strip()],
                     'case_sensitive': case_sensitive_var.get(),
-                    'require_space': spacebar_trigger_var.get()
+                    'require_space': spacebar_trigger_var.get(),
+                    'match_suffix': match_suffix_var.get(),
+                    'pattern': pattern_var.get(),
+                    'max_typos': max_typos_var.get(),
+                    'priority': priority_var.get()
                 }
+                error = pattern_error(trigger, data) if data['pattern'] else None
+                if error:
+                    messagebox.showerror("Error", f"Invalid trigger pattern: {error}")
+                    return
+                self.expander.set_trigger(trigger, data)
                 self.expander.save_triggers()
-                self.refresh_triggers()
                 dialog.destroy()
             else:
                 messagebox.showerror("Error", "Trigger cannot be empty!")
@@ -416,12 +751,29 @@ class SettingsUI:
             self.tree.delete(item)
         
         for trigger, data in self.expander.triggers.items():
-            self.tree.insert('', 'end', values=(
-                'Yes' if data['enabled'] else 'No',
-                trigger,
-                data['response'],
-                ', '.join(data.get('tags', []))
-            ))
+            self.tree.insert('', 'end', iid=trigger, values=self.row_values(trigger, data))
+
+    def row_values(self, trigger, data):
+        return (
+            'Yes' if data['enabled'] else 'No',
+            trigger,
+            data['response'],
+            ', '.join(data.get('tags', []))
+        )
+
+    def on_trigger_changed(self, trigger, old, new):
+        # Only touch the row of the trigger that changed.
+        if new is None:
+            if self.tree.exists(trigger):
+                self.tree.delete(trigger)
+            return
+        values = self.row_values(trigger, new)
+        if self.tree.exists(trigger):
+            self.tree.item(trigger, values=values)
+        else:
+            search_text = self.search_var.get().lower()
+            if not search_text or any(search_text in str(v).lower() for v in values):
+                self.tree.insert('', 'end', iid=trigger, values=values)
 
     def filter_triggers(self):
         search_text = self.search_var.get().lower()
@@ -433,22 +785,17 @@ class SettingsUI:
                     self.tree.delete(item)
 
     def toggle_selected(self, enabled):
-        for item in self.tree.selection():
-            values = self.tree.item(item)['values']
-            trigger = values[1]
-            if trigger in self.expander.triggers:
-                self.expander.triggers[trigger]['enabled'] = enabled
+        # Rows are keyed by their trigger.
+        with self.expander.editing():
+            for trigger in self.tree.selection():
+                self.expander.set_enabled(trigger, enabled)
         self.expander.save_triggers()
-        self.refresh_triggers()
 
     def delete_selected(self):
-        for item in self.tree.selection():
-            values = self.tree.item(item)['values']
-            trigger = values[1]
-            if trigger in self.expander.triggers:
-                del self.expander.triggers[trigger]
+        with self.expander.editing():
+            for trigger in self.tree.selection():
+                self.expander.delete_trigger(trigger)
         self.expander.save_triggers()
-        self.refresh_triggers()
 
     def export_csv(self):
         filename = filedialog.asksaveasfilename(
@@ -472,20 +819,66 @@ class SettingsUI:
             filetypes=[("CSV files", "*.csv")]
         )
         if filename:
-            with open(filename, 'r') as f:
+            with open(filename, 'r') as f, self.expander.editing():
                 reader = csv.DictReader(f)
                 for row in reader:
-                    self.expander.triggers[row['Trigger']] = {
+                    self.expander.set_trigger(row['Trigger'], {
                         'response': row['Response'],
                         'tags': row['Tags'].split(';') if row['Tags'] else [],
                         'enabled': row['Enabled'].lower() == 'true'
-                    }
+                    })
             self.expander.save_triggers()
-            self.refresh_triggers()
 
     def update_space_trigger(self):
         self.expander.settings['require_space'] = self.space_trigger_var.get()
         self.expander.save_settings()
+        self.expander.rebuild_matcher()
+
+    def calibrate_pacing(self):
+        # Self-test: types a sample into a text box of our own at falling
+        # rates and keeps the fastest one that comes through intact.
+        if not self.expander.pacing:
+            messagebox.showinfo("Calibrate Typing Speed", "Adaptive pacing is turned off in settings.json.")
+            return
+        window = tk.Toplevel(self.root)
+        window.title("Calibrating Typing Speed")
+        window.configure(bg='#121212')
+        tk.Label(window, text="Typing a test sentence, please don't touch the keyboard.",
+                 bg='#121212', fg='white').pack(padx=20, pady=10)
+        echo = tk.Text(window, width=60, height=4, bg='#2b2b2b', fg='white')
+        echo.pack(padx=20, pady=(0, 20))
+        window.grab_set()
+        calibration = Calibration()
+        # Set by the injector, on its own thread, once a pass was typed.
+        typed = threading.Event()
+
+        # The typed keys only reach the window while the main loop is free
+        # to handle them, so each pass is started, waited for and checked
+        # from timers instead of blocking it.
+        def type_pass():
+            echo.delete('1.0', 'end')
+            echo.focus_force()
+            typed.clear()
+            self.expander.injector.replace(0, calibration.text, rate=calibration.rate, done=typed.set)
+            window.after(50, wait_for_pass)
+
+        def wait_for_pass():
+            if typed.is_set():
+                # Let the window take in the last keys.
+                window.after(500, check_pass)
+            else:
+                window.after(50, wait_for_pass)
+
+        def check_pass():
+            if not calibration.passed(echo.get('1.0', 'end-1c')):
+                type_pass()
+                return
+            self.expander.pacing.calibrated(calibration.result)
+            window.destroy()
+            speed = "as fast as possible" if calibration.result is None else f"{calibration.result} characters per second"
+            messagebox.showinfo("Calibrate Typing Speed", f"Expansions will be typed {speed}.")
+
+        type_pass()
 
     def toggle_window_visibility(self):
         if self.window_visible:
@@ -0,0 +1,1148 @@
+import heapq
+import json
+import re
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections import deque
+from collections.abc import Mapping
+
+from trigger_store import RecordSnapshot
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+# Markers fed to the automata alongside the typed characters. WORD_START
+# follows every character that ends a word (and begins every fresh state),
+# so triggers that must start a word are compiled with it in front.
+# WORD_END is only ever probed when a terminator key is pressed, so
+# triggers that wait for one are compiled with it at the end.
+WORD_START = '\x00'
+WORD_END = '\x01'
+
+# Longest text a pattern trigger is matched against; also caps repeat counts.
+PATTERN_MAX_LENGTH = 64
+
+# Most typos a trigger can allow with `max_typos`.
+MAX_TYPOS = 2
+
+
+def is_boundary(char):
+    """ True for characters that separate words (spaces, punctuation). """
+    return not char.isalnum()
+
+
+def lower_chars(text):
+    """
+    `text` lowered one character at a time, as typing lowers it: unlike
+    `str.lower`, a final sigma stays 'σ'.
+    """
+    return ''.join(char.lower() for char in text)
+
+
+def encode_trigger(trigger, data, require_space=False, folded=False):
+    """
+    Returns the automaton pattern for a trigger: boundary characters are
+    followed by WORD_START just like in the typed stream, and the trigger is
+    anchored to the start of a word unless `match_suffix` is set, and to a
+    terminator key if it (or the global `require_space`) asks for one. With
+    `folded` the trigger is lowered one character at a time, boundaries
+    still being those of the characters typed.
+    """
+    fold = str.lower if folded else str
+    pattern = ''.join(fold(char) + WORD_START if is_boundary(char) else fold(char) for char in trigger)
+    if not data.get('match_suffix', False):
+        pattern = WORD_START + pattern
+    if require_space or data.get('require_space', False):
+        pattern += WORD_END
+    return pattern
+
+
+class TriggerAutomaton:
+    """
+    Aho-Corasick automaton compiled from `(pattern, trigger)` pairs.
+
+    The automaton is fed one typed character at a time with `step`, and
+    `matches` lists every trigger whose pattern the typed text currently ends
+    with. Both calls cost the same no matter how many patterns were compiled,
+    so a large trigger pack doesn't slow down typing. The automaton is never
+    modified after it is built; when the trigger set changes a new one is
+    compiled and swapped in.
+
+    `matches` lists triggers in the order they were given, so callers pass
+    them in the order overlapping matches should be tried; `match_ranks`
+    lists their ranks, i.e. their positions in `triggers`, instead.
+    `can_extend` tells whether typing more could still reach a longer
+    pattern.
+
+    States are int32 IDs into flat arrays, numbered breadth-first so the
+    children of a state have consecutive IDs sorted by character:
+
+    - `chars[s]`: code point of the character leading into `s`
+    - `children[s]:children[s + 1]`: IDs of the children of `s`
+    - `fail[s]`: longest proper suffix of `s` that is also a state
+    - `outputs[s]:outputs[s + 1]`: slice of `ranks` for patterns ending at `s`
+    - `output_link[s]`: nearest fail state with outputs of its own
+    - `extends[s]`: `s` or one of its fail states has children
+
+    That is about 21 bytes per trie node, and `to_bytes`/`from_bytes` store
+    and load a compiled automaton without going through the patterns again.
+    """
+
+    arrays = ('chars', 'children', 'fail', 'outputs', 'output_link', 'ranks', 'extends')
+    magic = b'STXA1'
+
+    def __init__(self, patterns=()):
+        rank = {}
+        entries = []
+        for pattern, trigger in patterns:
+            if pattern and trigger not in rank:
+                rank[trigger] = len(rank)
+                entries.append((pattern, rank[trigger]))
+        # Trigger of each rank.
+        self.triggers = list(rank)
+        entries.sort()
+        self._build(entries)
+        self._link()
+
+    def _build(self, entries):
+        # Breadth-first over the sorted patterns: each queued state covers
+        # the run of patterns sharing its prefix, which splits into one run
+        # per next character. States are numbered as they are queued.
+        self.chars = array('i', [0])
+        self.children = array('i')
+        self.outputs = array('i')
+        self.ranks = array('i')
+        queue = deque([(0, len(entries), 0)])
+        while queue:
+            start, end, depth = queue.popleft()
+            self.children.append(len(self.chars))
+            self.outputs.append(len(self.ranks))
+            while start < end and len(entries[start][0]) == depth:
+                self.ranks.append(entries[start][1])
+                start += 1
+            while start < end:
+                char = entries[start][0][depth]
+                run_end = start + 1
+                while run_end < end and entries[run_end][0][depth] == char:
+                    run_end += 1
+                self.chars.append(ord(char))
+                queue.append((start, run_end, depth + 1))
+                start = run_end
+        self.children.append(len(self.chars))
+        self.outputs.append(len(self.ranks))
+
+    def _link(self):
+        # In ID order, which is breadth-first, so every fail state is
+        # finished before it is used.
+        count = len(self.chars)
+        children, outputs = self.children, self.outputs
+        self.fail = fail = array('i', bytes(4 * count))
+        self.output_link = output_link = array('i', bytes(4 * count))
+        self.extends = extends = array('b', bytes(count))
+        for state in range(count):
+            if state:
+                fallback = fail[state]
+                output_link[state] = fallback if outputs[fallback] < outputs[fallback + 1] else output_link[fallback]
+                extends[state] = children[state] < children[state + 1] or extends[fallback]
+            for child in range(children[state], children[state + 1]):
+                fail[child] = self._child(fail[state], self.chars[child]) if state else 0
+
+    def _child(self, state, code):
+        # Follows fail links until some state has a child for `code`. Most
+        # states have a single child, which needs no search.
+        chars, children, fail = self.chars, self.children, self.fail
+        while state:
+            start, end = children[state], children[state + 1]
+            if end - start == 1:
+                if chars[start] == code:
+                    return start
+            elif start < end:
+                child = bisect_left(chars, code, start, end)
+                if child < end and chars[child] == code:
+                    return child
+            state = fail[state]
+        end = children[1]
+        child = bisect_left(chars, code, 1, end)
+        return child if child < end and chars[child] == code else 0
+
+    def __len__(self):
+        return len(self.chars)
+
+    def step(self, state, char):
+        """ Returns the state reached after typing `char` in `state`. """
+        return self._child(state, ord(char))
+
+    def match_ranks(self, state):
+        """ Ranks of the triggers the typed text ends with in `state`. """
+        outputs, output_link = self.outputs, self.output_link
+        link = output_link[state]
+        if outputs[state] == outputs[state + 1]:
+            if not link:
+                return ()
+            state, link = link, output_link[link]
+        ranks = self.ranks[outputs[state]:outputs[state + 1]].tolist()
+        if link:
+            # Shorter patterns ending here too; put them in rank order.
+            while link:
+                ranks += self.ranks[outputs[link]:outputs[link + 1]]
+                link = output_link[link]
+            ranks.sort()
+        return ranks
+
+    def matches(self, state):
+        """ Triggers the typed text ends with in `state`. """
+        triggers = self.triggers
+        return tuple(triggers[rank] for rank in self.match_ranks(state))
+
+    def can_extend(self, state):
+        """ True if a longer pattern could still match after `state`. """
+        return bool(self.extends[state])
+
+    def to_bytes(self):
+        """ The compiled automaton, for `from_bytes`. """
+        parts = [self.magic]
+        for name in self.arrays:
+            values = getattr(self, name)
+            if sys.byteorder == 'big':
+                values = array(values.typecode, values)
+                values.byteswap()
+            parts += [struct.pack('<I', len(values)), values.tobytes()]
+        parts.append(json.dumps(self.triggers).encode('utf-8'))
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """ Loads an automaton saved with `to_bytes`. """
+        if not data.startswith(cls.magic):
+            raise ValueError("not a compiled trigger automaton")
+        automaton = object.__new__(cls)
+        offset = len(cls.magic)
+        for name in cls.arrays:
+            values = array('b' if name == 'extends' else 'i')
+            count, = struct.unpack_from('<I', data, offset)
+            offset += 4
+            values.frombytes(data[offset:offset + count * values.itemsize])
+            offset += count * values.itemsize
+            if sys.byteorder == 'big':
+                values.byteswap()
+            setattr(automaton, name, values)
+        automaton.triggers = json.loads(data[offset:].decode('utf-8'))
+        return automaton
+
+
+def pattern_flags(data):
+    return 0 if data.get('case_sensitive', False) else re.IGNORECASE
+
+
+def parse_pattern(trigger, data):
+    """ Parses a pattern trigger, raising ValueError if it is invalid. """
+    try:
+        parsed = sre_parse.parse(trigger, pattern_flags(data))
+    except re.error as e:
+        raise ValueError(str(e))
+    if parsed.getwidth()[0] == 0:
+        raise ValueError("pattern can match empty text")
+    return parsed
+
+
+def pattern_error(trigger, data):
+    """ Why a pattern trigger can't be used, or None if it can. """
+    try:
+        _PatternNFA().add(trigger, data)
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+def typo_limit(data):
+    """ Typos a trigger allows, 0 for pattern triggers. """
+    if data.get('pattern', False):
+        return 0
+    return min(max(int(data.get('max_typos', 0) or 0), 0), MAX_TYPOS)
+
+
+def allowed_typos(trigger, data):
+    """
+    Typos a trigger tolerates: its `max_typos`, but at most one per three
+    characters so short triggers don't fire on unrelated words.
+    """
+    return min(typo_limit(data), len(trigger) // 3)
+
+
+def typo_distance(typed, trigger, limit):
+    """ Edit distance between two strings, or `limit + 1` if it is over `limit`. """
+    previous = list(range(len(trigger) + 1))
+    for i, char in enumerate(typed, 1):
+        current = [i]
+        for j, trigger_char in enumerate(trigger, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != trigger_char)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous[-1], limit + 1)
+
+
+def trigger_length(trigger, data):
+    """ Most typed characters a trigger can match. """
+    if not data.get('pattern', False):
+        return len(trigger) + allowed_typos(trigger, data)
+    try:
+        return min(parse_pattern(trigger, data).getwidth()[1], PATTERN_MAX_LENGTH)
+    except ValueError:
+        return 0
+
+
+def expand(trigger, data, typed):
+    """
+    Returns `(count, response)` for a trigger the `typed` text ends with: how
+    many typed characters to replace, and with what. The response of a
+    pattern trigger is a template that can use the pattern's groups (`\\1`,
+    `\\g<name>`). Returns None if the match doesn't fit in `typed`.
+    """
+    if allowed_typos(trigger, data):
+        return _typo_expansion(trigger, data, typed)
+    if not data.get('pattern', False):
+        return len(trigger), data['response']
+    # The automaton only says that a match ends here; `re` finds where it
+    # starts and what the groups hold. This only runs when a pattern fired.
+    regex = re.compile(trigger, pattern_flags(data))
+    anchored = not data.get('match_suffix', False)
+    for start in range(max(len(typed) - PATTERN_MAX_LENGTH, 0), len(typed)):
+        if anchored and start and not is_boundary(typed[start - 1]):
+            continue
+        match = regex.fullmatch(typed, start)
+        if match:
+            try:
+                return len(match.group()), match.expand(data['response'])
+            except re.error:
+                return len(match.group()), data['response']
+    return None
+
+
+def _typo_expansion(trigger, data, typed):
+    # The automaton only says that some word start is within reach; pick the
+    # one closest to the trigger, preferring the shortest text to replace.
+    # Text is lowered after slicing, so counts stay in typed characters even
+    # where one lowers to several.
+    fold = str if data.get('case_sensitive', False) else lower_chars
+    folded = fold(trigger)
+    start = len(typed) - len(trigger)
+    if (start >= 0 and fold(typed[start:]) == folded
+            and (start == 0 or data.get('match_suffix', False) or is_boundary(typed[start - 1]))):
+        return len(trigger), data['response']
+    limit = allowed_typos(trigger, data)
+    best = None
+    for start in range(max(len(typed) - len(trigger) - limit, 0), len(typed)):
+        if start and not is_boundary(typed[start - 1]):
+            continue
+        distance = typo_distance(fold(typed[start:]), folded, limit)
+        if distance <= limit and (best is None or distance <= best[0]):
+            best = (distance, len(typed) - start)
+    return None if best is None else (best[1], data['response'])
+
+
+class _PatternNFA:
+    """
+    Thompson NFA built from parsed pattern triggers. Transitions test one
+    typed character each; anything that needs more context than the current
+    character (anchors, look-arounds, back-references) is rejected.
+    """
+
+    unsupported = {
+        sre_parse.AT: "anchors",
+        sre_parse.ASSERT: "look-arounds",
+        sre_parse.ASSERT_NOT: "look-arounds",
+        sre_parse.GROUPREF: "back-references",
+        sre_parse.GROUPREF_EXISTS: "conditional groups",
+    }
+
+    def __init__(self):
+        self.epsilon = []
+        self.edges = []
+        # Followed only on WORD_END, for triggers waiting for a terminator.
+        self.end_edges = {}
+        # node -> (rank, trigger)
+        self.accept = {}
+        # Start nodes of patterns that must start a word, and of the rest.
+        self.anchored = []
+        self.floating = []
+
+    def node(self):
+        self.epsilon.append([])
+        self.edges.append([])
+        return len(self.edges) - 1
+
+    def add(self, trigger, data, require_space=False, rank=0):
+        parsed = parse_pattern(trigger, data)
+        start, end = self._sequence(parsed, parsed.state.flags)
+        if require_space or data.get('require_space', False):
+            self.end_edges[end] = self.node()
+            end = self.end_edges[end]
+        self.accept[end] = (rank, trigger)
+        if data.get('match_suffix', False):
+            self.floating.append(start)
+        else:
+            self.anchored.append(start)
+
+    def closure(self, nodes):
+        found = set(nodes)
+        stack = list(found)
+        while stack:
+            for node in self.epsilon[stack.pop()]:
+                if node not in found:
+                    found.add(node)
+                    stack.append(node)
+        return frozenset(found)
+
+    def _sequence(self, items, flags):
+        start = end = self.node()
+        for op, av in items:
+            first, last = self._item(op, av, flags)
+            self.epsilon[end].append(first)
+            end = last
+        return start, end
+
+    def _char(self, test):
+        start, end = self.node(), self.node()
+        self.edges[start].append((test, end))
+        return start, end
+
+    def _item(self, op, av, flags):
+        ignore_case = bool(flags & re.IGNORECASE)
+        if op == sre_parse.LITERAL:
+            return self._char(_literal_test(chr(av), ignore_case))
+        if op == sre_parse.NOT_LITERAL:
+            test = _literal_test(chr(av), ignore_case)
+            return self._char(lambda char: not test(char))
+        if op == sre_parse.ANY:
+            return self._char(lambda char: True)
+        if op == sre_parse.IN:
+            return self._char(_set_test(av, ignore_case))
+        if op == sre_parse.BRANCH:
+            start, end = self.node(), self.node()
+            for items in av[1]:
+                first, last = self._sequence(items, flags)
+                self.epsilon[start].append(first)
+                self.epsilon[last].append(end)
+            return start, end
+        if op == sre_parse.SUBPATTERN:
+            group, add_flags, del_flags, items = av
+            return self._sequence(items, (flags | add_flags) & ~del_flags)
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            low, high, items = av
+            unbounded = high == sre_parse.MAXREPEAT
+            if low > PATTERN_MAX_LENGTH or not unbounded and high > PATTERN_MAX_LENGTH:
+                raise ValueError("repeat count is too large")
+            start = end = self.node()
+            for _ in range(low):
+                first, last = self._sequence(items, flags)
+                self.epsilon[end].append(first)
+                end = last
+            if unbounded:
+                first, last = self._sequence(items, flags)
+                self.epsilon[end].append(first)
+                self.epsilon[last].append(end)
+            else:
+                exit = self.node()
+                for _ in range(high - low):
+                    first, last = self._sequence(items, flags)
+                    self.epsilon[end] += [first, exit]
+                    end = last
+                self.epsilon[end].append(exit)
+                end = exit
+            return start, end
+        raise ValueError("trigger patterns can't use %s"
+                         % self.unsupported.get(op, str(op).lower().replace('_', ' ')))
+
+
+def _literal_test(literal, ignore_case):
+    if not ignore_case:
+        return literal.__eq__
+    literal = literal.lower()
+    return lambda char: char.lower() == literal
+
+
+def _range_test(low, high, ignore_case):
+    if not ignore_case:
+        return lambda char: low <= char <= high
+    return lambda char: low <= char <= high or low <= char.lower() <= high or low <= char.upper() <= high
+
+
+_category_tests = {
+    sre_parse.CATEGORY_DIGIT: str.isdecimal,
+    sre_parse.CATEGORY_NOT_DIGIT: lambda char: not char.isdecimal(),
+    sre_parse.CATEGORY_SPACE: str.isspace,
+    sre_parse.CATEGORY_NOT_SPACE: lambda char: not char.isspace(),
+    sre_parse.CATEGORY_WORD: lambda char: char.isalnum() or char == '_',
+    sre_parse.CATEGORY_NOT_WORD: lambda char: not (char.isalnum() or char == '_'),
+}
+
+
+def _set_test(items, ignore_case):
+    negate = False
+    tests = []
+    for op, av in items:
+        if op == sre_parse.NEGATE:
+            negate = True
+        elif op == sre_parse.LITERAL:
+            tests.append(_literal_test(chr(av), ignore_case))
+        elif op == sre_parse.RANGE:
+            tests.append(_range_test(chr(av[0]), chr(av[1]), ignore_case))
+        elif op == sre_parse.CATEGORY and av in _category_tests:
+            tests.append(_category_tests[av])
+        else:
+            raise ValueError("character sets can't use %s" % str(op).lower().replace('_', ' '))
+    return lambda char: any(test(char) for test in tests) != negate
+
+
+class PatternAutomaton:
+    """
+    Pattern (regular expression) triggers compiled together into one NFA,
+    which is turned into a DFA lazily: each DFA state is the set of NFA nodes
+    active after some typed text, and its transitions are worked out the
+    first time a character is typed in it, then cached. Typing therefore
+    costs a dictionary lookup per character no matter how many patterns
+    there are, and only the states real typing reaches are ever built.
+
+    Like `TriggerAutomaton`, states are ints and `matches` lists the
+    triggers the typed text ends with. WORD_START starts the patterns that
+    must start a word; WORD_END finishes those waiting for a terminator.
+    Invalid patterns are left out (the editor reports them).
+
+    The cache is bounded by `max_states` and `max_transitions`; once either
+    is reached it is flushed and rebuilt from the states typing goes on to
+    reach. State ids are never reused, so a state from before a flush (e.g.
+    one a backspace goes back to) is known to be stale and taken as the root.
+
+    States are only built from the keyboard thread.
+    """
+
+    max_states = 4096
+    max_transitions = 65536
+
+    def __init__(self, records=(), require_space=False):
+        self.nfa = _PatternNFA()
+        # Trigger of each rank.
+        self.triggers = []
+        for rank, (trigger, data) in enumerate(records):
+            self.triggers.append(trigger)
+            try:
+                self.nfa.add(trigger, data, require_space, rank)
+            except ValueError:
+                pass
+        self.floating = self.nfa.closure(self.nfa.floating)
+        self.starts = self.nfa.closure(self.nfa.anchored) | self.floating
+        # Id of the first cached state.
+        self.first = 0
+        self.sets = []
+        # State 0 is the root (nothing matched yet).
+        self._flush()
+
+    def __len__(self):
+        return len(self.sets)
+
+    def _flush(self):
+        self.first += len(self.sets)
+        self.sets = []
+        self.ids = {}
+        self.next = []
+        self.output = []
+        self.extends = []
+        self.transitions = 0
+        self._state(self.floating)
+
+    def _index(self, state):
+        # The root stands in for states from before the last flush.
+        return max(state - self.first, 0)
+
+    def _state(self, nodes):
+        state = self.ids.get(nodes)
+        if state is None:
+            state = self.ids[nodes] = self.first + len(self.sets)
+            self.sets.append(nodes)
+            self.next.append({})
+            accept = self.nfa.accept
+            self.output.append(tuple(rank for rank, trigger in sorted(accept[node] for node in nodes if node in accept)))
+            # Patterns that have only just started don't count as going on.
+            self.extends.append(any(self.nfa.edges[node] for node in nodes - self.starts))
+        return state
+
+    def _move(self, nodes, char):
+        nfa = self.nfa
+        if char == WORD_START:
+            return nfa.closure(nodes | set(nfa.anchored))
+        if char == WORD_END:
+            return nfa.closure(nfa.end_edges[node] for node in nodes if node in nfa.end_edges)
+        return nfa.closure([target for node in nodes for test, target in nfa.edges[node] if test(char)]) | self.floating
+
+    def step(self, state, char):
+        """ Returns the state reached after typing `char` in `state`. """
+        if not self.nfa.accept:
+            return 0
+        index = self._index(state)
+        next_state = self.next[index].get(char)
+        if next_state is None:
+            nodes = self.sets[index]
+            if len(self.sets) >= self.max_states or self.transitions >= self.max_transitions:
+                self._flush()
+                index = self._index(self._state(nodes))
+            next_state = self.next[index][char] = self._state(self._move(nodes, char))
+            self.transitions += 1
+        return next_state
+
+    def match_ranks(self, state):
+        """ Ranks of the triggers the typed text ends with in `state`. """
+        return self.output[self._index(state)]
+
+    def matches(self, state):
+        """ Triggers the typed text ends with in `state`. """
+        triggers = self.triggers
+        return tuple(triggers[rank] for rank in self.output[self._index(state)])
+
+    def can_extend(self, state):
+        """ True if a pattern could still match more after `state`. """
+        return self.extends[self._index(state)]
+
+
+class TypoAutomaton:
+    """
+    Triggers that allow typos (`max_typos`), matched by a Levenshtein
+    automaton intersected with a trie of the triggers.
+
+    A state is the set of `(trie_node, typos)` pairs still within reach of
+    some trigger, keeping the fewest typos per node: a typed character
+    either matches or replaces the next trigger character, or is an extra
+    character; trigger characters can also be left out. Nodes are dropped
+    as soon as their typos exceed what every trigger below them allows, so
+    only the few nodes near the typed text are ever visited. As with
+    `PatternAutomaton`, these sets are turned into DFA states lazily and
+    their transitions cached, in a cache bounded the same way by
+    `max_states` and `max_transitions`.
+
+    Matching starts at every WORD_START. To keep typos from firing on a word
+    that is still being typed, typo matches are only reported after
+    WORD_END, i.e. when a terminator key is pressed; exact matches go
+    through the literal automata as usual.
+    """
+
+    max_states = 4096
+    max_transitions = 65536
+
+    def __init__(self, records=()):
+        # Two tries, one per case mode; node 0 is the exact root and node 1
+        # the folded one.
+        self.children = [{}, {}]
+        self.folded = [False, True]
+        self.limit = [0, 0]
+        # node -> [(rank, allowed typos)]
+        self.accept = {}
+        # Trigger of each rank.
+        self.triggers = []
+        for rank, (trigger, data) in enumerate(records):
+            self.triggers.append(trigger)
+            folded = not data.get('case_sensitive', False)
+            self._insert(lower_chars(trigger) if folded else trigger, int(folded), rank, allowed_typos(trigger, data))
+        # Id of the first cached state.
+        self.first = 0
+        self.sets = []
+        # State 0 is the root (nothing matched yet).
+        self._flush()
+
+    def __len__(self):
+        return len(self.sets)
+
+    def _flush(self):
+        self.first += len(self.sets)
+        self.sets = []
+        self.ended = []
+        self.ids = {}
+        self.next = []
+        self.output = []
+        self.transitions = 0
+        self._state(frozenset(), False)
+
+    def _index(self, state):
+        # The root stands in for states from before the last flush.
+        return max(state - self.first, 0)
+
+    def _insert(self, pattern, node, rank, limit):
+        self.limit[node] = max(self.limit[node], limit)
+        for char in pattern:
+            next_node = self.children[node].get(char)
+            if next_node is None:
+                next_node = self.children[node][char] = len(self.children)
+                self.children.append({})
+                self.folded.append(self.folded[node])
+                self.limit.append(0)
+            node = next_node
+            self.limit[node] = max(self.limit[node], limit)
+        self.accept.setdefault(node, []).append((rank, limit))
+
+    def _state(self, reached, ended):
+        key = (reached, ended)
+        state = self.ids.get(key)
+        if state is None:
+            state = self.ids[key] = self.first + len(self.sets)
+            self.sets.append(dict(reached))
+            self.ended.append(ended)
+            self.next.append({})
+            found = []
+            if ended:
+                for node, typos in reached:
+                    for rank, limit in self.accept.get(node, ()):
+                        if 0 < typos <= limit:
+                            found.append(rank)
+            self.output.append(tuple(sorted(found)))
+        return state
+
+    def _relax(self, reached, node, typos):
+        if typos <= self.limit[node] and typos < reached.get(node, MAX_TYPOS + 1):
+            reached[node] = typos
+            # Leaving out the next trigger character.
+            for child in self.children[node].values():
+                self._relax(reached, child, typos + 1)
+
+    def _move(self, reached, char):
+        if char == WORD_START:
+            moved = dict(reached)
+            self._relax(moved, 0, 0)
+            self._relax(moved, 1, 0)
+            return moved
+        if char == WORD_END:
+            return {}
+        lowered = char.lower()
+        if len(lowered) == 1:
+            return self._advance(reached, char, lowered)
+        # Some characters lower to several (e.g. 'İ' to 'i' and a combining
+        # dot); the folded trie takes those one at a time.
+        moved = self._advance({node: typos for node, typos in reached.items() if not self.folded[node]}, char, char)
+        folded = {node: typos for node, typos in reached.items() if self.folded[node]}
+        for folded_char in lowered:
+            folded = self._advance(folded, folded_char, folded_char)
+        moved.update(folded)
+        return moved
+
+    def _advance(self, reached, char, lowered):
+        moved = {}
+        for node, typos in reached.items():
+            # An extra typed character.
+            self._relax(moved, node, typos + 1)
+            typed = lowered if self.folded[node] else char
+            for trigger_char, child in self.children[node].items():
+                self._relax(moved, child, typos + (trigger_char != typed))
+        return moved
+
+    def step(self, state, char):
+        """ Returns the state reached after typing `char` in `state`. """
+        if not self.accept:
+            return 0
+        index = self._index(state)
+        next_state = self.next[index].get(char)
+        if next_state is None:
+            reached = self.sets[index]
+            if len(self.sets) >= self.max_states or self.transitions >= self.max_transitions:
+                ended = self.ended[index]
+                self._flush()
+                index = self._index(self._state(frozenset(reached.items()), ended))
+            if char == WORD_END:
+                next_state = self._state(frozenset(reached.items()), True)
+            else:
+                next_state = self._state(frozenset(self._move(reached, char).items()), False)
+            self.next[index][char] = next_state
+            self.transitions += 1
+        return next_state
+
+    def match_ranks(self, state):
+        """ Ranks of the triggers within their typos of the typed text. """
+        return self.output[self._index(state)]
+
+    def matches(self, state):
+        """ Triggers within their typos of the typed text. """
+        triggers = self.triggers
+        return tuple(triggers[rank] for rank in self.output[self._index(state)])
+
+
+def trigger_priority(data):
+    return int(data.get('priority', 0) or 0)
+
+
+def overlap_key(trigger, data):
+    """
+    Sort key putting first the trigger that wins when several match at once:
+    the longest (for patterns, the longest text they can match), then the
+    one with the highest `priority`.
+    """
+    length = trigger_length(trigger, data) if data.get('pattern', False) else len(trigger)
+    return (-length, -trigger_priority(data))
+
+
+def compile_key(data):
+    """
+    The parts of a trigger's data that decide how it is compiled. A trigger
+    whose key changes has to be recompiled; other edits (response, tags,
+    enabled) only change what a match does.
+    """
+    return (
+        bool(data.get('case_sensitive', False)),
+        bool(data.get('match_suffix', False)),
+        bool(data.get('require_space', False)),
+        bool(data.get('pattern', False)),
+        typo_limit(data),
+        trigger_priority(data),
+    )
+
+
+class CompiledTriggers:
+    """
+    Triggers compiled into automata that are advanced together: an exact
+    one for case-sensitive triggers, a lower-cased one for the rest, and a
+    `PatternAutomaton` for pattern triggers. Each typed character is lowered
+    once for the folded path, so matching never has to lower the buffer.
+    Triggers that allow typos are also compiled into a `TypoAutomaton`.
+
+    Triggers are compiled in `overlap_key` order, so every automaton already
+    lists its matches best first and `matches` only has to merge them.
+    `matches` gives the matched records as their positions in `records`;
+    `order` lists those positions best first, and each automaton has an
+    int array mapping its ranks to places in `order`.
+
+    Matching state is an `(exact_state, folded_state, pattern_state,
+    typo_state)` tuple.
+
+    The exact and folded automata are most of the compile time, so
+    `save_literals` stores them and passing that back as `literals` loads
+    them instead of compiling the same records again.
+    """
+
+    def __init__(self, records=(), require_space=False, literals=None):
+        exact, folded, patterns, typos = [], [], [], []
+        records = list(records)
+        self.order = array('i', sorted(range(len(records)), key=lambda position: overlap_key(*records[position])))
+        for position in self.order:
+            trigger, data = records[position]
+            if allowed_typos(trigger, data):
+                typos.append((trigger, data))
+            if data.get('pattern', False):
+                patterns.append((trigger, data))
+            elif literals is None:
+                if data.get('case_sensitive', False):
+                    exact.append((encode_trigger(trigger, data, require_space), trigger))
+                else:
+                    folded.append((encode_trigger(trigger, data, require_space, folded=True), trigger))
+        if literals is None:
+            self.exact = TriggerAutomaton(exact)
+            self.folded = TriggerAutomaton(folded)
+        else:
+            self.exact, self.folded = self.load_literals(literals)
+        self.patterns = PatternAutomaton(patterns, require_space)
+        self.typos = TypoAutomaton(typos)
+        place = {records[position][0]: place for place, position in enumerate(self.order)}
+        self.exact_places = array('i', (place[trigger] for trigger in self.exact.triggers))
+        self.folded_places = array('i', (place[trigger] for trigger in self.folded.triggers))
+        self.pattern_places = array('i', (place[trigger] for trigger in self.patterns.triggers))
+        self.typo_places = array('i', (place[trigger] for trigger in self.typos.triggers))
+        self.start = self.step((0, 0, 0, 0), WORD_START)
+
+    def save_literals(self):
+        """ The exact and folded automata, for `literals`. """
+        exact = self.exact.to_bytes()
+        return struct.pack('<I', len(exact)) + exact + self.folded.to_bytes()
+
+    @staticmethod
+    def load_literals(data):
+        if len(data) < 4:
+            raise ValueError("not compiled triggers")
+        length, = struct.unpack_from('<I', data)
+        return (TriggerAutomaton.from_bytes(data[4:4 + length]),
+                TriggerAutomaton.from_bytes(data[4 + length:]))
+
+    def step(self, state, char):
+        exact_state, folded_state, pattern_state, typo_state = state
+        lowered = char.lower()
+        if len(lowered) == 1:
+            folded_state = self.folded.step(folded_state, lowered)
+        else:
+            # Lowered to several characters (e.g. 'İ' to 'i' and a
+            # combining dot), which the folded triggers were compiled with.
+            for folded_char in lowered:
+                folded_state = self.folded.step(folded_state, folded_char)
+        return (self.exact.step(exact_state, char), folded_state,
+                self.patterns.step(pattern_state, char), self.typos.step(typo_state, char))
+
+    def matches(self, state):
+        exact_state, folded_state, pattern_state, typo_state = state
+        exact, folded = self.exact.match_ranks(exact_state), self.folded.match_ranks(folded_state)
+        patterns, typos = self.patterns.match_ranks(pattern_state), self.typos.match_ranks(typo_state)
+        if not (exact or folded or patterns or typos):
+            return ()
+        found = [[places[rank] for rank in ranks] for ranks, places in (
+            (exact, self.exact_places), (folded, self.folded_places),
+            (patterns, self.pattern_places), (typos, self.typo_places)) if ranks]
+        order = self.order
+        return tuple(order[place] for place in (found[0] if len(found) == 1 else heapq.merge(*found)))
+
+    def can_extend(self, state):
+        exact_state, folded_state, pattern_state, typo_state = state
+        return (self.exact.can_extend(exact_state) or self.folded.can_extend(folded_state)
+                or self.patterns.can_extend(pattern_state))
+
+
+class TriggerIndex:
+    """
+    Immutable compiled view of the trigger set.
+
+    The keyboard thread matches against an index without any locking, so an
+    index is never modified once built. Edits go through `edited`, which
+    returns a new index for the caller to publish with a single reference
+    swap; the keyboard thread picks it up on its next key.
+
+    To keep edits cheap the triggers are split between a large `base` and a
+    small `delta` holding the triggers added (or recompiled) since the base
+    was compiled. The records the base was compiled from are kept as a
+    `RecordSnapshot`, which for a `TriggerStore` is just its slots. Changed
+    and deleted triggers are kept in `overrides` (trigger -> data, or None
+    once deleted) and looked up before the base records. An edit therefore costs time proportional to the changed
+    triggers plus the bounded overrides; once the overrides outgrow that
+    bound everything is compiled into a fresh base.
+
+    `require_space` makes every trigger wait for a terminator key, as if
+    each had its own `require_space` set.
+
+    `literals` is what `save_literals` returned for the same records and
+    `require_space`, to load instead of compiling them again.
+
+    Matching state is a `(base_state, delta_state)` pair, see `step`.
+    """
+
+    min_compact_size = 64
+
+    def __init__(self, records=None, require_space=False, literals=None):
+        if isinstance(records, Mapping):
+            records = records.items()
+        # In the order triggers were given. Never modified.
+        self.base_records = RecordSnapshot(records or ())
+        self.require_space = require_space
+        self.base = CompiledTriggers(self.base_records.items(), require_space, literals)
+        self.delta_triggers = ()
+        self.delta = _empty_triggers
+        self.overrides = {}
+        # Longest enabled trigger; only grows until the next compaction.
+        self.max_length = _max_length(self.base_records.items())
+
+    def save_literals(self):
+        """ The compiled base, for `literals`. Edits are not included. """
+        return self.base.save_literals()
+
+    def _overrides_limit(self):
+        return max(self.min_compact_size, int(len(self.base_records) ** 0.5))
+
+    def get(self, trigger):
+        """ Data of a trigger, or None if it doesn't exist. """
+        data = self.overrides.get(trigger, _missing)
+        if data is _missing:
+            return self.base_records.get(trigger)
+        return data
+
+    def records(self):
+        """ Yields (trigger, data) for every trigger, in order. """
+        return _merge_records(self.base_records, self.overrides)
+
+    def in_base(self, trigger, data):
+        """ True if the base compiled `trigger` the way `data` needs it. """
+        base_data = self.base_records.get(trigger)
+        return base_data is data or base_data is not None and compile_key(base_data) == compile_key(data)
+
+    def edited(self, changes):
+        """
+        Returns a new index with `changes` (trigger -> new data, or None to
+        delete) applied. This index is left untouched.
+        """
+        overrides = dict(self.overrides)
+        overrides.update(changes)
+        if len(overrides) > self._overrides_limit():
+            return TriggerIndex(_merge_records(self.base_records, overrides), self.require_space)
+
+        index = object.__new__(TriggerIndex)
+        index.base_records = self.base_records
+        index.require_space = self.require_space
+        index.base = self.base
+        index.overrides = overrides
+        index.max_length = max(self.max_length, _max_length(changes.items()))
+        delta_triggers = tuple(
+            (trigger, compile_key(data)) for trigger, data in overrides.items()
+            if data is not None and not self.in_base(trigger, data)
+        )
+        if delta_triggers == self.delta_triggers:
+            index.delta_triggers, index.delta = self.delta_triggers, self.delta
+        else:
+            index.delta_triggers = delta_triggers
+            index.delta = CompiledTriggers(((trigger, overrides[trigger]) for trigger, _ in delta_triggers),
+                                           self.require_space)
+        return index
+
+    def start(self):
+        """ State before anything was typed. """
+        return (self.base.start, self.delta.start)
+
+    def translate(self, previous, state):
+        """
+        Converts a state of the `previous` index into a state of this one,
+        keeping what was typed so far whenever the base is shared.
+        """
+        if previous is not None and previous.base is self.base:
+            return (state[0], self.delta.start)
+        return self.start()
+
+    def step(self, state, char):
+        """ Returns the state reached after typing `char` in `state`. """
+        base, delta = self.base, self.delta
+        base_state, delta_state = state
+        base_state, delta_state = base.step(base_state, char), delta.step(delta_state, char)
+        if is_boundary(char):
+            base_state, delta_state = base.step(base_state, WORD_START), delta.step(delta_state, WORD_START)
+        return (base_state, delta_state)
+
+    def terminated_matches(self, state):
+        """
+        Like `matches`, but for the triggers waiting for a terminator key,
+        as if one was pressed in `state`. `state` itself is left as is.
+        """
+        base_state, delta_state = state
+        return self.matches((self.base.step(base_state, WORD_END), self.delta.step(delta_state, WORD_END)))
+
+    def matches(self, state):
+        """
+        (trigger, data) of the enabled triggers the typed text ends with,
+        the one that should win first (see `overlap_key`).
+        """
+        base_state, delta_state = state
+        base_records, overrides = self.base_records, self.overrides
+        found = []
+        for position in self.base.matches(base_state):
+            trigger = base_records.triggers[position]
+            data = base_records.data(position)
+            override = overrides.get(trigger, _missing)
+            if override is not _missing:
+                if override is None or compile_key(override) != compile_key(data):
+                    continue
+                data = override
+            if data.get('enabled', True):
+                found.append((trigger, data))
+        delta_found = []
+        delta_triggers = self.delta_triggers
+        for position in self.delta.matches(delta_state):
+            trigger = delta_triggers[position][0]
+            data = overrides[trigger]
+            if data.get('enabled', True):
+                delta_found.append((trigger, data))
+        if found and delta_found:
+            return list(heapq.merge(found, delta_found, key=lambda record: overlap_key(*record)))
+        return found or delta_found
+
+    def can_extend(self, state):
+        """ True if typing more could still match a longer trigger. """
+        base_state, delta_state = state
+        return self.base.can_extend(base_state) or self.delta.can_extend(delta_state)
+
+
+class TypingBuffer:
+    """
+    Fixed-capacity ring buffer holding the most recently typed characters,
+    each with the matcher state reached after typing it.
+
+    Appending is constant time no matter how long the user types without a
+    break; once the buffer is full the oldest character is dropped. The
+    capacity only needs to cover the longest trigger. Because states are
+    kept, a backspace restores the previous matcher state with `pop` instead
+    of rescanning the text.
+    """
+
+    def __init__(self, capacity=1):
+        self.chars = [''] * max(capacity, 1)
+        self.states = [None] * len(self.chars)
+        self.end = 0
+        self.size = 0
+
+    @property
+    def capacity(self):
+        return len(self.chars)
+
+    def __len__(self):
+        return self.size
+
+    def __str__(self):
+        return self.tail(self.size)
+
+    def append(self, char, state=None):
+        end = self.end
+        self.chars[end] = char
+        self.states[end] = state
+        self.end = (end + 1) % len(self.chars)
+        if self.size < len(self.chars):
+            self.size += 1
+
+    def pop(self):
+        """
+        Removes the last character and returns the state it was typed in,
+        or None if that is older than what the buffer holds.
+        """
+        if not self.size:
+            return None
+        self.size -= 1
+        self.end = (self.end - 1) % len(self.chars)
+        if not self.size:
+            return None
+        return self.states[self.end - 1]
+
+    def last(self):
+        """ Last character typed, or '' if empty. """
+        return self.chars[self.end - 1] if self.size else ''
+
+    def clear(self):
+        self.size = 0
+
+    def tail(self, count):
+        """ Returns the last `count` characters typed (or fewer if missing). """
+        count = min(count, self.size)
+        start = self.end - count
+        if start >= 0:
+            return ''.join(self.chars[start:self.end])
+        return ''.join(self.chars[start:]) + ''.join(self.chars[:self.end])
+
+    def map_states(self, function):
+        """ Replaces every stored state with `function(state)`. """
+        for i in range(self.end - self.size, self.end):
+            self.states[i] = function(self.states[i])
+
+    def resize(self, capacity):
+        """ Changes the capacity, keeping as many recent characters as fit. """
+        count = min(capacity, self.size)
+        entries = [(self.chars[i], self.states[i]) for i in range(self.end - count, self.end)]
+        self.chars = [''] * max(capacity, 1)
+        self.states = [None] * len(self.chars)
+        self.end = self.size = 0
+        for char, state in entries:
+            self.append(char, state)
+
+
+def _max_length(records):
+    return max((trigger_length(trigger, data) for trigger, data in records
+                if data is not None and data.get('enabled', True)), default=0)
+
+
+def _merge_records(base_records, overrides):
+    for trigger, data in base_records.items():
+        data = overrides.get(trigger, data)
+        if data is not None:
+            yield trigger, data
+    for trigger, data in overrides.items():
+        if data is not None and trigger not in base_records:
+            yield trigger, data
+
+
+_missing = object()
+_empty_triggers = CompiledTriggers()
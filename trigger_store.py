@@ -0,0 +1,289 @@
+from array import array
+from collections.abc import Mapping, MutableMapping
+
+# Fields the columns hold, in the order records list them.
+FIELDS = ('enabled', 'response', 'tags', 'case_sensitive', 'require_space',
+          'match_suffix', 'pattern', 'max_typos', 'priority')
+BOOL_FIELDS = ('enabled', 'case_sensitive', 'require_space', 'match_suffix', 'pattern')
+
+# Layout of a record's flags: one "present" bit per field, then the value
+# bits of the boolean fields, then max_typos.
+PRESENT_BITS = {field: 1 << i for i, field in enumerate(FIELDS)}
+VALUE_BITS = {field: 1 << (len(FIELDS) + i) for i, field in enumerate(BOOL_FIELDS)}
+TYPOS_SHIFT = len(FIELDS) + len(BOOL_FIELDS)
+TYPOS_MASK = 0b11
+
+
+class _Columns:
+    """
+    Struct-of-arrays storage for trigger records. A record is a slot index
+    into every column; responses live in one UTF-8 arena addressed by
+    offset and length, and tags are interned into small ints stored in a
+    second arena. Values a column can't hold (a non-bool `enabled`, unknown
+    fields) are kept as-is in `extras`.
+
+    Slots are only ever appended, never rewritten, so a `TriggerRecord`
+    keeps reading the data it was created for.
+    """
+
+    def __init__(self, tag_names=None, tag_ids=None):
+        self.flags = array('I')
+        self.priority = array('i')
+        self.response_start = array('q')
+        self.response_length = array('I')
+        self.tag_start = array('I')
+        self.tag_count = array('H')
+        self.responses = bytearray()
+        self.tags = array('I')
+        # Shared with compacted copies, tag IDs never change.
+        self.tag_names = [] if tag_names is None else tag_names
+        self.tag_ids = {} if tag_ids is None else tag_ids
+        self.extras = {}
+
+    def __len__(self):
+        return len(self.flags)
+
+    def _tag_id(self, tag):
+        tag_id = self.tag_ids.get(tag)
+        if tag_id is None:
+            tag_id = self.tag_ids[tag] = len(self.tag_names)
+            self.tag_names.append(tag)
+        return tag_id
+
+    def append(self, data):
+        """ Stores a record from a mapping and returns its slot. """
+        flags = 0
+        priority = 0
+        response = b''
+        tags = ()
+        extras = {}
+        for field, value in data.items():
+            if field in VALUE_BITS and type(value) is bool:
+                flags |= PRESENT_BITS[field] | (VALUE_BITS[field] if value else 0)
+            elif field == 'max_typos' and type(value) is int and 0 <= value <= TYPOS_MASK:
+                flags |= PRESENT_BITS[field] | value << TYPOS_SHIFT
+            elif field == 'priority' and type(value) is int and -2 ** 31 <= value < 2 ** 31:
+                flags |= PRESENT_BITS[field]
+                priority = value
+            elif field == 'response' and type(value) is str:
+                flags |= PRESENT_BITS[field]
+                response = value.encode('utf-8', 'surrogatepass')
+            elif field == 'tags' and type(value) is list and all(type(tag) is str for tag in value) \
+                    and len(value) < 2 ** 16:
+                flags |= PRESENT_BITS[field]
+                tags = [self._tag_id(tag) for tag in value]
+            else:
+                extras[field] = value
+        slot = len(self.flags)
+        self.flags.append(flags)
+        self.priority.append(priority)
+        self.response_start.append(len(self.responses))
+        self.response_length.append(len(response))
+        self.responses += response
+        self.tag_start.append(len(self.tags))
+        self.tag_count.append(len(tags))
+        self.tags.extend(tags)
+        if extras:
+            self.extras[slot] = extras
+        return slot
+
+    def copy(self, columns, slot):
+        """ Copies a slot of other columns sharing our tags, returns its new slot. """
+        start, length = columns.response_start[slot], columns.response_length[slot]
+        tag_start, tag_count = columns.tag_start[slot], columns.tag_count[slot]
+        new_slot = len(self.flags)
+        self.flags.append(columns.flags[slot])
+        self.priority.append(columns.priority[slot])
+        self.response_start.append(len(self.responses))
+        self.response_length.append(length)
+        self.responses += columns.responses[start:start + length]
+        self.tag_start.append(len(self.tags))
+        self.tag_count.append(tag_count)
+        self.tags.extend(columns.tags[tag_start:tag_start + tag_count])
+        if slot in columns.extras:
+            self.extras[new_slot] = columns.extras[slot]
+        return new_slot
+
+    def fields(self, slot):
+        flags = self.flags[slot]
+        present = [field for field in FIELDS if flags & PRESENT_BITS[field]]
+        return present + list(self.extras.get(slot, ()))
+
+    def get(self, slot, field):
+        """ Value of `field` in a slot; raises KeyError if it isn't set. """
+        flags = self.flags[slot]
+        if not flags & PRESENT_BITS.get(field, 0):
+            return self.extras.get(slot, {})[field]
+        value_bit = VALUE_BITS.get(field)
+        if value_bit:
+            return bool(flags & value_bit)
+        if field == 'response':
+            start = self.response_start[slot]
+            return self.responses[start:start + self.response_length[slot]].decode('utf-8', 'surrogatepass')
+        if field == 'tags':
+            start = self.tag_start[slot]
+            return [self.tag_names[tag] for tag in self.tags[start:start + self.tag_count[slot]]]
+        if field == 'max_typos':
+            return flags >> TYPOS_SHIFT & TYPOS_MASK
+        return self.priority[slot]
+
+
+class TriggerRecord(Mapping):
+    """
+    Read-only dict-like view of one stored trigger. Lists it returns (tags)
+    are fresh copies; edit a trigger by storing a new mapping, e.g.
+    `store[trigger] = dict(record, enabled=False)`.
+    """
+
+    __slots__ = ('columns', 'slot')
+
+    def __init__(self, columns, slot):
+        self.columns = columns
+        self.slot = slot
+
+    def __getitem__(self, field):
+        return self.columns.get(self.slot, field)
+
+    def get(self, field, default=None):
+        # Called for every flag check while matching, so skip the generic
+        # Mapping.get.
+        try:
+            return self.columns.get(self.slot, field)
+        except KeyError:
+            return default
+
+    def __iter__(self):
+        return iter(self.columns.fields(self.slot))
+
+    def __len__(self):
+        return len(self.columns.fields(self.slot))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class TriggerStore(MutableMapping):
+    """
+    Compact trigger -> data mapping, a drop-in for the dict loaded from
+    triggers.json. Each record costs a few dozen bytes of columns instead
+    of a dict, a list and boxed values (see `_Columns`); reading a trigger
+    returns a `TriggerRecord` view.
+
+    Storing a trigger always writes a new slot, so views handed out earlier
+    (e.g. to a matcher snapshot on the keyboard thread) never change under
+    their reader. The slots left behind are reclaimed by `compact`, which
+    moves the live records to fresh columns once they outnumber them.
+    """
+
+    min_compact_size = 1024
+
+    def __init__(self, triggers=None):
+        self.slots = {}
+        self.columns = _Columns()
+        self.garbage = 0
+        if triggers:
+            self.update(triggers)
+
+    def __getitem__(self, trigger):
+        return TriggerRecord(self.columns, self.slots[trigger])
+
+    def __setitem__(self, trigger, data):
+        if trigger in self.slots:
+            self.garbage += 1
+        self.slots[trigger] = self.columns.append(data)
+        self._maybe_compact()
+
+    def __delitem__(self, trigger):
+        del self.slots[trigger]
+        self.garbage += 1
+        self._maybe_compact()
+
+    def __iter__(self):
+        return iter(self.slots)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, trigger):
+        return trigger in self.slots
+
+    def _maybe_compact(self):
+        if self.garbage > max(self.min_compact_size, len(self.slots)):
+            self.compact()
+
+    def compact(self):
+        """ Moves the live records to new columns, dropping replaced ones. """
+        old = self.columns
+        self.columns = _Columns(old.tag_names, old.tag_ids)
+        self.slots = {trigger: self.columns.copy(old, slot) for trigger, slot in self.slots.items()}
+        self.garbage = 0
+
+    def to_dict(self):
+        """ Plain dicts for every trigger, e.g. for saving to JSON. """
+        return {trigger: dict(TriggerRecord(self.columns, slot)) for trigger, slot in self.slots.items()}
+
+
+class RecordSnapshot:
+    """
+    Immutable list of (trigger, data) records, e.g. the ones a matcher was
+    compiled from, kept in the order given.
+
+    Records that are `TriggerRecord` views of one store's columns are kept
+    as their slots in those columns, so a snapshot of a `TriggerStore` costs
+    a few ints per trigger on top of the trigger strings it shares with the
+    store. Any other records are copied into columns of the snapshot's own,
+    with their slots stored as `~slot`. Triggers are looked up by binary
+    search over `by_trigger`, the positions sorted by trigger.
+    """
+
+    def __init__(self, records=()):
+        self.triggers = []
+        self.slots = array('i')
+        self.columns = None
+        self.own_columns = _Columns()
+        for trigger, data in records:
+            self.triggers.append(trigger)
+            if type(data) is TriggerRecord and self.columns is None:
+                self.columns = data.columns
+            if type(data) is TriggerRecord and data.columns is self.columns:
+                self.slots.append(data.slot)
+            else:
+                self.slots.append(~self.own_columns.append(data))
+        triggers = self.triggers
+        self.by_trigger = array('i', sorted(range(len(triggers)), key=triggers.__getitem__))
+
+    def __len__(self):
+        return len(self.triggers)
+
+    def data(self, position):
+        slot = self.slots[position]
+        if slot < 0:
+            return TriggerRecord(self.own_columns, ~slot)
+        return TriggerRecord(self.columns, slot)
+
+    def find(self, trigger):
+        """ Position of `trigger`, or -1 if it isn't in the snapshot. """
+        triggers, by_trigger = self.triggers, self.by_trigger
+        low, high = 0, len(by_trigger)
+        while low < high:
+            middle = (low + high) // 2
+            if triggers[by_trigger[middle]] < trigger:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(by_trigger) and triggers[by_trigger[low]] == trigger:
+            return by_trigger[low]
+        return -1
+
+    def __contains__(self, trigger):
+        return self.find(trigger) >= 0
+
+    def get(self, trigger):
+        """ Data of `trigger`, or None if it isn't in the snapshot. """
+        position = self.find(trigger)
+        return None if position < 0 else self.data(position)
+
+    def items(self):
+        """ Yields (trigger, data) for every record, in order. """
+        for position, trigger in enumerate(self.triggers):
+            yield trigger, self.data(position)